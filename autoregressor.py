@@ -2,7 +2,9 @@ import os
 import pytorch_lightning as pl
 from src.mapping_helper import StandardMap
 from src.data_helper import Data
+from src.cache_helper import DatasetCache
 from src.dmd import DMD
+from src.inference_helper import InferenceRuntime
 from argparse import ArgumentParser, Namespace
 from src.utils import (
     read_yaml,
@@ -11,7 +13,12 @@ from src.utils import (
     plot_heat_map,
     plot_spatial_errors,
 )
-from typing import Optional, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Tuple
+import multiprocessing
+import pandas as pd
+import tempfile
+import shutil
 import warnings
 
 warnings.filterwarnings(
@@ -24,6 +31,10 @@ logging.getLogger("pytorch_lightning").setLevel(0)
 pl.seed_everything(42, workers=True)
 
 
+SEEDS: List[int] = [42, 41]
+INPUT_SUFFIXES: List[str] = ["standard", "random1"]
+
+
 def main(args: Namespace):
     version: Optional[int] = args.version or None
     directory_path: str = "logs/cluster/K01/long_term"
@@ -31,114 +42,171 @@ def main(args: Namespace):
 
     folders = get_inference_folders(directory_path, version)
 
+    # NOTE: every evaluation dataset is generated once and shared read-only through the cache,
+    # a temporary one in shared memory if no cache_dir is given
+    cache_dir: str = args.cache_dir or tempfile.mkdtemp(
+        prefix="evaluation_cache_",
+        dir="/dev/shm" if os.path.isdir("/dev/shm") else None,
+    )
+
+    try:
+        generate_evaluation_data(folders, args, DatasetCache(cache_dir))
+
+        if args.workers > 1:
+            # spawned workers start without the parent's torch threads
+            with ProcessPoolExecutor(
+                max_workers=args.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        evaluate_version,
+                        [args] * len(folders),
+                        folders,
+                        [cache_dir] * len(folders),
+                    )
+                )
+        else:
+            results = [
+                evaluate_version(args, log_path, cache_dir) for log_path in folders
+            ]
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    summary = pd.DataFrame([row for rows in results for row in rows])
+    print()
+    print(summary.to_string(index=False))
+    summary.to_csv(os.path.join(directory_path, "evaluation_summary.csv"), index=False)
+
+
+def get_evaluation_params(log_path: str) -> Tuple[dict, dict]:
+    params_path: str = os.path.join(log_path, "hparams.yaml")
+    params: dict = read_yaml(params_path)
+
+    params_update = {}
+    params_update.update({"sampling": "random"})
+    params_update.update({"steps": 160})
+    params_update.update({"init_points": 50})
+    # params_update.update({"acc_threshold": 1.0e-4})
+
+    params.update(params_update)
+
+    return params, params_update
+
+
+def generate_evaluation_data(
+    folders: List[str], args: Namespace, cache: DatasetCache
+) -> None:
+    """
+    Generates the trajectories of every distinct evaluation map once and saves them to cache.
+    """
+    keys = set()
     for log_path in folders:
-        print()
-        print(f"log_path: {log_path}")
-        params_path: str = os.path.join(log_path, "hparams.yaml")
-        params: dict = read_yaml(params_path)
-
-        params_update = {}
-        params_update.update({"sampling": "random"})
-        params_update.update({"steps": 160})
-        params_update.update({"init_points": 50})
-        # params_update.update({"acc_threshold": 1.0e-4})
-
-        params.update(params_update)
-        maps: List[StandardMap] = [
-            StandardMap(seed=42, params=params),
-            StandardMap(seed=41, params=params),
-        ]
-        input_suffixes: list[str] = ["standard", "random1"]
-
-        for map, input_suffix in zip(maps, input_suffixes):
-
-            predictions, _ = inference(args, log_path, params, map, params_update)
-
-            print(
-                f"{input_suffix} loss: {predictions['loss'].item():.3e}, accuracy: {predictions['accuracy'].item():.5f}"
-            )
-
-            plot_2d(
-                predictions["predicted"],
-                predictions["targets"],
-                show_plot=False,
-                plot_lines=True,
-                save_path=os.path.join(log_path, input_suffix),
-                loss=predictions["loss"].item(),
-                accuracy=predictions["accuracy"].item(),
-            )
-
-            plot_heat_map(
-                predictions["predicted"],
-                predictions["targets"],
-                save_path=os.path.join(log_path, input_suffix) + "_histogram",
-                show_plot=False,
-            )
-
-            plot_spatial_errors(
-                predictions["predicted"],
-                predictions["targets"],
-                save_path=os.path.join(log_path, input_suffix) + "_errors",
-                show_plot=False,
-            )
-
-            # dmd: DMD = DMD([predictions["predicted"], predictions["targets"]])
-            # dmd.plot_source_matrix(titles=["Predicted", "Targets"])
-            # dmd._generate_dmd_results()
-            # dmd.plot_eigenvalues(titles=["Predicted", "Targets"])
-            # dmd.plot_abs_values(titles=["Predicted", "Targets"])
-
-        print()
-        print("-----------------------------")
+        params, _ = get_evaluation_params(log_path)
+        for seed in SEEDS:
+            map_object = StandardMap(seed=seed, params=params)
+            key = DatasetCache.make_key(map_object.get_params())
+            if key not in keys:
+                keys.add(key)
+                Data._retrieve_trajectories(map_object, cache)
+
+
+def evaluate_version(args: Namespace, log_path: str, cache_dir: str) -> List[dict]:
+    """
+    Evaluates the model in log_path on all evaluation maps and returns one row of the summary per map.
+    """
+    print()
+    print(f"log_path: {log_path}")
+    params, params_update = get_evaluation_params(log_path)
+    cache = DatasetCache(cache_dir)
+
+    # the model is loaded once and reused for every evaluation map
+    runtime = InferenceRuntime(log_path, params_update, compile=args.compile)
+
+    rows = []
+    for seed, input_suffix in zip(SEEDS, INPUT_SUFFIXES):
+        map = StandardMap(seed=seed, params=params)
+
+        predictions = inference(runtime, map, cache, args.predict_batch_size)
+
+        print(
+            f"{input_suffix} loss: {predictions['loss'].item():.3e}, accuracy: {predictions['accuracy'].item():.5f}"
+        )
+        rows.append(
+            {
+                "version": os.path.basename(log_path),
+                "seed": seed,
+                "input": input_suffix,
+                "loss": predictions["loss"].item(),
+                "accuracy": predictions["accuracy"].item(),
+            }
+        )
+
+        plot_2d(
+            predictions["predicted"],
+            predictions["targets"],
+            show_plot=False,
+            plot_lines=True,
+            save_path=os.path.join(log_path, input_suffix),
+            loss=predictions["loss"].item(),
+            accuracy=predictions["accuracy"].item(),
+        )
+
+        plot_heat_map(
+            predictions["predicted"],
+            predictions["targets"],
+            save_path=os.path.join(log_path, input_suffix) + "_histogram",
+            show_plot=False,
+        )
+
+        plot_spatial_errors(
+            predictions["predicted"],
+            predictions["targets"],
+            save_path=os.path.join(log_path, input_suffix) + "_errors",
+            show_plot=False,
+        )
+
+        # dmd: DMD = DMD([predictions["predicted"], predictions["targets"]])
+        # dmd.plot_source_matrix(titles=["Predicted", "Targets"])
+        # dmd._generate_dmd_results()
+        # dmd.plot_eigenvalues(titles=["Predicted", "Targets"])
+        # dmd.plot_abs_values(titles=["Predicted", "Targets"])
+
+    print()
+    print("-----------------------------")
+
+    return rows
 
 
 def inference(
-    args: Namespace,
-    log_path: str,
-    params: dict,
+    runtime: InferenceRuntime,
     map: StandardMap,
-    params_update: dict,
-) -> tuple[dict, Data]:
-
-    if params.get("rnn_type") == "vanillarnn":
-        from src.VanillaRNN import Vanilla as Model
-    elif params.get("rnn_type") == "mgu":
-        from src.MGU import MGU as Model
-    elif params.get("rnn_type") == "resrnn":
-        from src.ResRNN import ResRNN as Model
-
-    Model.compile_model = args.compile
-
-    model_path: str = os.path.join(log_path, f"model.ckpt")
-    model = Model(**params).load_from_checkpoint(
-        model_path, map_location="cpu", **params_update
-    )
-    model.eval()
+    cache: Optional[DatasetCache] = None,
+    batch_size: Optional[int] = None,
+) -> dict:
+    trajectories = Data._retrieve_trajectories(map, cache)
 
-    # regression seed to take
-    model.regression_seed = params.get("seq_length")
-
-    datamodule: Data = Data(
-        map_object=map,
-        params=params,
-    )
-
-    trainer = pl.Trainer(
-        precision=params["precision"],
-        enable_progress_bar=False,
-        logger=False,
-        deterministic=True,
-    )
-
-    predictions: dict = trainer.predict(model=model, dataloaders=datamodule)[0]
-
-    return predictions, datamodule
+    return runtime.predict(trajectories, batch_size=batch_size)
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--version", "-v", nargs="*", type=int, default=None)
     parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Versions evaluated at once in a process pool.",
+    )
+    parser.add_argument(
+        "--predict_batch_size",
+        type=int,
+        default=None,
+        help="Trajectories rolled out at once, all of them if not set.",
+    )
     args = parser.parse_args()
 
     main(args)
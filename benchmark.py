@@ -0,0 +1,260 @@
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Tuple, Callable
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from src.mapping_helper import StandardMap, numba
+from src.data_helper import Data
+from src.utils import read_yaml
+from trainer import get_model
+
+
+def reference_generate_data(map_object: StandardMap) -> Tuple[np.ndarray]:
+    """
+    Per-K loop used by StandardMap.generate_data before it was vectorized.
+    """
+    map_object.rng = np.random.default_rng(seed=map_object.seed)
+    theta_i, p_i = map_object._get_initial_points()
+    K_list = map_object._get_K_list()
+
+    theta_values = np.zeros((map_object.steps, theta_i.shape[0] * len(K_list)))
+    p_values = np.zeros((map_object.steps, p_i.shape[0] * len(K_list)))
+
+    theta_values[0] = np.tile(theta_i, len(K_list))
+    p_values[0] = np.tile(p_i, len(K_list))
+
+    for i, K in enumerate(K_list):
+        theta = theta_i.copy()
+        p = p_i.copy()
+        for step in range(1, map_object.steps):
+            theta = np.mod(theta + p, 1)
+            p = np.mod(p + K / (2 * np.pi) * np.sin(2 * np.pi * theta), 1)
+            theta_values[step, i * theta_i.shape[0] : (i + 1) * theta_i.shape[0]] = (
+                theta
+            )
+            p_values[step, i * p_i.shape[0] : (i + 1) * p_i.shape[0]] = p
+
+    return theta_values, p_values
+
+
+def benchmark_mapping(args: Namespace) -> None:
+    params = {
+        "init_points": args.init_points,
+        "steps": args.steps,
+        "K": [0.1, 2.0, args.num_K],
+        "sampling": "random",
+        "dtype": "float64",
+    }
+
+    map_object = StandardMap(seed=42, params=params)
+
+    start = time.perf_counter()
+    theta_ref, p_ref = reference_generate_data(map_object)
+    reference_time = time.perf_counter() - start
+
+    map_object.rng = np.random.default_rng(seed=42)
+    start = time.perf_counter()
+    map_object.generate_data()
+    vectorized_time = time.perf_counter() - start
+    theta_values, p_values = map_object.retrieve_data()
+
+    identical = np.array_equal(theta_ref, theta_values) and np.array_equal(
+        p_ref, p_values
+    )
+    points_steps = args.init_points * args.num_K * args.steps
+
+    print(
+        f"K values: {args.num_K}, init_points: {args.init_points}, steps: {args.steps}"
+    )
+    print(
+        f"per-K loop:  {reference_time:.3f} s "
+        f"({points_steps / reference_time:.3e} points*steps/s)"
+    )
+    print(
+        f"vectorized:  {vectorized_time:.3f} s "
+        f"({points_steps / vectorized_time:.3e} points*steps/s)"
+    )
+    print(f"speedup:     {reference_time / vectorized_time:.2f}x")
+    print(f"bit-for-bit identical: {identical}")
+
+    if not identical:
+        raise AssertionError("Vectorized trajectories differ from the per-K loop.")
+
+    print()
+    for backend in ["numpy", "numba"]:
+        if backend == "numba" and numba is None:
+            print(f"{backend:<6} not installed")
+            continue
+        map_object = StandardMap(seed=42, params=params, backend=backend)
+        if backend == "numba":
+            # first call compiles the kernel (or loads it from the cache)
+            map_object.steps = 2
+            map_object.generate_data()
+            map_object.steps = args.steps
+            map_object.rng = np.random.default_rng(seed=42)
+        start = time.perf_counter()
+        map_object.generate_data()
+        backend_time = time.perf_counter() - start
+        reference = np.stack((theta_ref.T, p_ref.T), axis=-1)
+        max_difference = np.max(
+            np.abs(map_object.retrieve_trajectories() - reference)
+        )
+        print(
+            f"{backend:<6} {backend_time:.3f} s ({points_steps / backend_time:.3e} points*steps/s), "
+            f"max difference to per-K loop: {max_difference:.1e}"
+        )
+
+
+class ReferencePairsDataset(torch.utils.data.Dataset):
+    """
+    List of (input, output) pairs with per-item torch.tensor, as Data used before Dataset was tensor-backed.
+    """
+
+    def __init__(self, sequences: torch.Tensor, output_length: int):
+        sequences = sequences.numpy()
+        self.data = [(seq[:-output_length], seq[-output_length:]) for seq in sequences]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor]:
+        x, y = self.data[idx]
+        return torch.tensor(x), torch.tensor(y)
+
+
+def _samples_per_second(dataloader: DataLoader, epochs: int) -> float:
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for inputs, _ in dataloader:
+            samples += inputs.shape[0]
+    return samples / (time.perf_counter() - start)
+
+
+def benchmark_dataloader(args: Namespace) -> None:
+    params = {
+        "init_points": args.init_points,
+        "steps": args.steps,
+        "K": 0.1,
+        "sampling": "random",
+        "seq_length": args.seq_length,
+        "batch_size": args.batch_size,
+        "every_n_step": 1,
+        "val_reg_preds": 1,
+        "shuffle_trajectories": True,
+        "shuffle_within_batches": True,
+        "drop_last": True,
+    }
+
+    datamodule = Data(map_object=StandardMap(seed=42, params=params), params=params)
+    train_dataset = datamodule.train_dataset
+
+    reference = DataLoader(
+        ReferencePairsDataset(
+            torch.cat(train_dataset[torch.arange(len(train_dataset))], dim=1), 1
+        ),
+        batch_size=args.batch_size,
+        shuffle=True,
+        drop_last=True,
+    )
+    per_index = datamodule.train_dataloader()
+    datamodule.batch_sampler = True
+    batched = datamodule.train_dataloader()
+
+    print(f"{len(train_dataset)} windows, batch_size: {args.batch_size}")
+    for name, dataloader in [
+        ("list of pairs + default collate", reference),
+        ("per-index sampler + __getitems__", per_index),
+        ("batch index sampler", batched),
+    ]:
+        rate = _samples_per_second(dataloader, args.epochs)
+        print(f"{name:<34} {rate:.3e} samples/s")
+
+
+def _seconds_per_call(function: Callable, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark_compile(args: Namespace) -> None:
+    params = read_yaml("config/default.yaml")
+    del params["gridsearch"]
+    params.update(
+        {
+            "rnn_type": args.rnn_type,
+            "seq_length": args.seq_length,
+            "batch_size": args.batch_size,
+        }
+    )
+
+    model_args = Namespace(checkpoint_path=None, compile=False)
+    model = get_model(model_args, params)
+    model.eval()
+
+    inputs = torch.rand(args.batch_size, args.seq_length, 2)
+
+    def forward() -> None:
+        model(inputs).sum().backward()
+
+    # NOTE: same grad mode as in warm_up, another one fails the compiled graph's guards and recompiles
+    def rollout() -> None:
+        with torch.inference_mode():
+            model.rollout(inputs, args.steps)
+
+    eager_forward = _seconds_per_call(forward, args.repeats)
+    eager_rollout = _seconds_per_call(rollout, args.repeats)
+
+    model.configure_compile()
+    compile_time = model.warm_up(args.batch_size, args.seq_length, args.steps)
+    # untimed calls, so that any remaining recompilation is not counted as a call
+    forward()
+    rollout()
+
+    compiled_forward = _seconds_per_call(forward, args.repeats)
+    compiled_rollout = _seconds_per_call(rollout, args.repeats)
+
+    print(
+        f"{args.rnn_type}, batch_size: {args.batch_size}, "
+        f"seq_length: {args.seq_length}, rollout steps: {args.steps}"
+    )
+    print(f"compile time (warm-up): {compile_time:.2f} s")
+    for name, eager, compiled in [
+        ("forward + backward", eager_forward, compiled_forward),
+        ("rollout", eager_rollout, compiled_rollout),
+    ]:
+        saved = eager - compiled
+        break_even = f"{compile_time / saved:.0f} calls" if saved > 0 else "never"
+        print(
+            f"{name:<19} eager {eager * 1e3:.2f} ms, compiled {compiled * 1e3:.2f} ms, "
+            f"speedup {eager / compiled:.2f}x, break-even after {break_even}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="Benchmark")
+    parser.add_argument(
+        "target",
+        choices=["mapping", "dataloader", "compile"],
+        help="Part of the pipeline to benchmark.",
+    )
+    parser.add_argument("--init_points", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--num_K", type=int, default=200)
+    parser.add_argument("--seq_length", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--rnn_type", type=str, default="vanillarnn")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.target == "mapping":
+        benchmark_mapping(args)
+    elif args.target == "dataloader":
+        benchmark_dataloader(args)
+    elif args.target == "compile":
+        benchmark_compile(args)
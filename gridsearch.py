@@ -6,11 +6,22 @@ from src.utils import (
     setup_logger,
     Gridsearch,
 )
+from src.search_helper import RandomSearch, TPESearch
+from update import get_loss_and_params
+
+
+def get_strategy(args: Namespace) -> RandomSearch:
+    if args.strategy == "tpe":
+        # fit on all trials in the experiment directory so far
+        return TPESearch(get_loss_and_params(args.path), n_startup=args.n_startup)
+    return RandomSearch()
 
 
 def main(args: Namespace) -> None:
     params_path = os.path.join(args.path, "parameters.yaml")
-    gridsearch = Gridsearch(params_path, use_defaults=args.default_params)
+    gridsearch = Gridsearch(
+        params_path, use_defaults=args.default_params, strategy=get_strategy(args)
+    )
     updated_params = gridsearch.update_params()
 
     save_yaml(updated_params, os.path.join(args.path, "current_params.yaml"))
@@ -0,0 +1,111 @@
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+import multiprocessing
+import logging
+import os
+
+from src.utils import import_parsed_args, setup_logger, Gridsearch
+
+
+def run_trial(args: Namespace, params: dict, cores: List[int]) -> int:
+    """
+    Trains one trial in a worker process pinned to cores and returns its version.
+    """
+    import torch
+    import trainer
+
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+    setup_logger(args.path, "rnn_autoregressor")
+    trainer.main(args, params)
+
+    return args.version
+
+
+def get_next_version(path: str) -> int:
+    versions = [
+        int(directory.split("_")[-1])
+        for directory in os.listdir(path)
+        if directory.startswith("version_")
+        and os.path.isdir(os.path.join(path, directory))
+    ]
+    return max(versions, default=-1) + 1
+
+
+def get_core_subsets(trials: int, cores_per_trial: Optional[int]) -> List[List[int]]:
+    cores = sorted(os.sched_getaffinity(0))
+    cores_per_trial = cores_per_trial or max(1, len(cores) // trials)
+
+    # trials share cores round-robin if there are not enough of them
+    return [
+        [
+            cores[(trial * cores_per_trial + core) % len(cores)]
+            for core in range(cores_per_trial)
+        ]
+        for trial in range(trials)
+    ]
+
+
+def main(args: Namespace) -> None:
+    import update
+    from gridsearch import get_strategy
+
+    logger = logging.getLogger("rnn_autoregressor")
+
+    params_path = os.path.join(args.path, "parameters.yaml")
+    core_subsets = get_core_subsets(args.trials, args.cores_per_trial)
+
+    # spawned workers start without the parent's torch threads and CUDA state
+    context = multiprocessing.get_context("spawn")
+
+    for step in range(1, args.rounds + 1):
+        # intervals and the history for the strategy may have changed after the last round
+        gridsearch = Gridsearch(params_path, strategy=get_strategy(args))
+        first_version = get_next_version(args.path)
+
+        with ProcessPoolExecutor(
+            max_workers=args.trials, mp_context=context
+        ) as executor:
+            futures = []
+            for trial in range(args.trials):
+                trial_args = Namespace(**vars(args))
+                trial_args.version = first_version + trial
+                if args.devices:
+                    trial_args.devices = [args.devices[trial % len(args.devices)]]
+
+                futures.append(
+                    executor.submit(
+                        run_trial,
+                        trial_args,
+                        gridsearch.update_params(),
+                        core_subsets[trial],
+                    )
+                )
+
+            for future in as_completed(futures):
+                try:
+                    logger.info(f"Finished version_{future.result()}.")
+                except Exception as e:
+                    logger.error(f"Trial failed: {e}")
+
+        logger.info(f"Finished round {step} of {args.rounds}.")
+
+        args.current_step = step
+        if args.current_step % args.check_every_n_steps == 0:
+            update.main(args)
+
+
+if __name__ == "__main__":
+    args: Namespace = import_parsed_args("Trial scheduler")
+    args.path = os.path.abspath(args.path)
+
+    logger = setup_logger(args.path, "rnn_autoregressor")
+    logger.info("Running scheduler.py")
+
+    print_args = args.__dict__.copy()
+    del print_args["path"]
+    logger.info(f"args = {print_args}")
+
+    main(args)
@@ -4,8 +4,11 @@ import torch.nn.functional as F
 import pytorch_lightning as pl
 from pytorch_lightning.utilities import rank_zero_only
 
-from typing import List
+from typing import List, Tuple, Optional, Any
+import numpy as np
 import pyprind
+import contextlib
+import time
 
 try:
     from src.custom_metrics import MSDLoss, PathAccuracy
@@ -16,10 +19,15 @@ except ModuleNotFoundError:
 
 
 class BaseRNN(pl.LightningModule):
+    # NOTE: read when the model is set up, so it can be changed after the class is defined
+    compile_model = False
+
     def __init__(self, **params):
         super(BaseRNN, self).__init__()
         self.save_hyperparameters()
 
+        self._compiled_rollout = None
+
         self.nonlin_hidden = params.get("nonlinearity_hidden")
         self.nonlin_lin = self.configure_non_linearity(params.get("nonlinearity_lin"))
 
@@ -33,6 +41,13 @@ class BaseRNN(pl.LightningModule):
         self.lr: float = params.get("lr")
         self.optimizer: str = params.get("optimizer")
 
+        # "stateful" carries the hidden state between autoregression steps, "window"
+        # reruns the model over the last seq_length points for every new point
+        self.rollout_mode: str = params.get("rollout_mode") or "stateful"
+        # NOTE: if set, predictions are written to a .npy memmap at this path
+        # (e.g. load_from_checkpoint(path, predict_output=...))
+        self.predict_output: Optional[str] = params.get("predict_output")
+
         # NOTE: This logic is for variable layer sizes
         hidden_sizes: List[int] = params.get("hidden_sizes")
         linear_sizes: List[int] = params.get("linear_sizes")
@@ -47,7 +62,7 @@ class BaseRNN(pl.LightningModule):
             self.num_lin_layers - 1
         )
 
-    def create_linear_layers(self, compile: bool):
+    def create_linear_layers(self):
         self.lins = nn.ModuleList([])
 
         if self.num_lin_layers == 1:
@@ -60,9 +75,178 @@ class BaseRNN(pl.LightningModule):
                 )
             self.lins.append(nn.Linear(self.linear_sizes[-1], 2))
 
-        if compile:
-            for layer in range(self.num_lin_layers):
-                self.lins[layer] = torch.compile(self.lins[layer], dynamic=False)
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.transpose(0, 1)
+        seq_len, batch_size, _ = x.size()
+
+        state = self.init_state(batch_size)
+
+        outputs = []
+        # rnn layers
+        for t in range(seq_len):
+            output, state = self.step(x[t], state)
+            outputs.append(output)
+
+        outputs = torch.stack(outputs)
+        outputs = outputs.transpose(0, 1)
+
+        return self.linear_forward(outputs)
+
+    def init_state(self, batch_size: int) -> Any:
+        """
+        Returns the recurrent state before the first timestep.
+        """
+        # h_ts[i].shape = [batch_size, hidden_sizes[i]]
+        return self._init_hidden(batch_size, self.hidden_sizes)
+
+    def step(self, x_t: torch.Tensor, state: Any) -> Tuple[torch.Tensor, Any]:
+        """
+        Advances the rnn layers by one timestep.
+
+        Returns the output of the last rnn layer and the new state.
+        """
+        raise NotImplementedError
+
+    def linear_forward(self, outputs: torch.Tensor) -> torch.Tensor:
+        for layer in range(self.num_lin_layers):
+            outputs = self.lins[layer](outputs)
+            outputs = self.nonlin_lin(outputs)
+
+        return outputs
+
+    def rollout(
+        self,
+        seed: torch.Tensor,
+        steps: int,
+        rollout_mode: Optional[str] = None,
+        pbar: Optional[pyprind.ProgBar] = None,
+    ) -> torch.Tensor:
+        """
+        Autoregressively predicts steps points that follow seed.
+
+        seed.shape = [batch_size, seq_len, 2], returned predicted.shape = [batch_size, steps, 2]
+
+        Note: rollout_mode="stateful" is O(steps), rollout_mode="window" is O(steps * seq_len) and
+        reproduces the sliding window predictions exactly.
+        """
+        rollout_mode = rollout_mode or self.rollout_mode
+        seed_len = seed.shape[1]
+
+        # all points are written into one preallocated buffer, model inputs are views of it
+        # NOTE: the buffer is written in place, so gradients can't flow through rollout
+        # buffer.shape = [batch_size, seq_len + steps, 2]
+        buffer = seed.new_empty(seed.shape[0], seed_len + steps, seed.shape[2])
+        buffer[:, :seed_len] = seed
+
+        if rollout_mode == "window":
+            for i in range(steps):
+                predicted_value = self(buffer[:, i : seed_len + i])
+                predicted_value = predicted_value[:, -1]
+                buffer[:, seed_len + i] = torch.remainder(predicted_value, 1.0)
+
+                if pbar is not None:
+                    pbar.update()
+
+        elif rollout_mode == "stateful":
+            if self._compiled_rollout is not None:
+                self._compiled_rollout(buffer, seed_len, steps)
+                if pbar is not None:
+                    pbar.update(steps)
+            else:
+                self._stateful_rollout(buffer, seed_len, steps, pbar)
+
+        else:
+            raise ValueError(f"Invalid rollout_mode: {rollout_mode}")
+
+        return buffer[:, seed_len:]
+
+    def _stateful_rollout(
+        self,
+        buffer: torch.Tensor,
+        seed_len: int,
+        steps: int,
+        pbar: Optional[pyprind.ProgBar] = None,
+    ) -> None:
+        # warm up on the seed
+        state = self.init_state(buffer.shape[0])
+        for t in range(seed_len):
+            output, state = self.step(buffer[:, t], state)
+
+        for i in range(steps):
+            predicted_value = self.linear_forward(output)
+            buffer[:, seed_len + i] = torch.remainder(predicted_value, 1.0)
+
+            if i < steps - 1:
+                output, state = self.step(buffer[:, seed_len + i], state)
+
+            if pbar is not None:
+                pbar.update()
+
+    def configure_compile(self, graph_cache: bool = False) -> None:
+        """
+        Compiles the whole forward and the whole stateful rollout with static shapes.
+
+        Note: A fixed seq_length and batch size (drop_last=True) reuse one graph, other shapes trigger a recompile.
+        With graph_cache=True compiled graphs are also cached on disk (a process-wide inductor setting), so later
+        runs with the same shapes skip most of the compile time.
+        """
+        if graph_cache:
+            torch._inductor.config.fx_graph_cache = True
+
+        self.compile(dynamic=False)
+        self._compiled_rollout = torch.compile(self._stateful_rollout, dynamic=False)
+
+    def warm_up(
+        self,
+        batch_size: int,
+        seq_length: int,
+        steps: int,
+        rollout_batch_size: Optional[int] = None,
+        precision_context: Optional[contextlib.AbstractContextManager] = None,
+    ) -> float:
+        """
+        Runs the forward (with gradients, as in training) and the rollout (under inference mode, as in validation)
+        once on random inputs, so that compilation happens here and not inside the first epoch.
+
+        Note: Compiled graphs are specialized on shapes and autocast state, so rollout_batch_size (batch_size if
+        None) and precision_context (e.g. the trainer's precision plugin forward context) should match the run.
+
+        Returns the time it took in seconds.
+        """
+        rollout_batch_size = rollout_batch_size or batch_size
+        precision_context = precision_context or contextlib.nullcontext()
+
+        start = time.perf_counter()
+
+        with precision_context:
+            inputs = torch.rand(batch_size, seq_length, 2, device=self.device)
+            self(inputs).sum().backward()
+            self.zero_grad(set_to_none=True)
+
+            with torch.inference_mode():
+                inputs = torch.rand(
+                    rollout_batch_size, seq_length, 2, device=self.device
+                )
+                self.rollout(inputs, steps)
+
+        return time.perf_counter() - start
+
+    def setup(self, stage: str) -> None:
+        if self.compile_model and self._compiled_rollout is None:
+            self.configure_compile(self.hparams.get("compile_graph_cache", False))
+
+    def on_fit_start(self) -> None:
+        if self.compile_model:
+            batch_size = self.hparams.get("batch_size")
+            compile_time = self.warm_up(
+                batch_size,
+                self.hparams.get("seq_length"),
+                self.hparams.get("val_reg_preds"),
+                # same batch size as Data.val_dataloader
+                rollout_batch_size=batch_size * 5,
+                precision_context=self.trainer.precision_plugin.forward_context(),
+            )
+            print(f"Compiled model in {compile_time:.1f} s.")
 
     def _init_hidden(self, shape0: int, hidden_shapes: int) -> list[torch.Tensor]:
         return [
@@ -114,6 +298,7 @@ class BaseRNN(pl.LightningModule):
         inputs: torch.Tensor
         targets: torch.Tensor
         inputs, targets = batch
+        inputs = inputs.to(self.dtype)
 
         predicted = self(inputs)
         predicted = predicted[:, -1:]
@@ -129,16 +314,11 @@ class BaseRNN(pl.LightningModule):
         inputs: torch.Tensor
         targets: torch.Tensor
         inputs, targets = batch
-        autoregression_seed = inputs.shape[1]
+        # cast once here, so that no casting happens inside the autoregression loop
+        inputs = inputs.to(self.dtype)
         autoregression_steps = targets.shape[1]
 
-        for i in range(autoregression_steps):
-            predicted_value = self(inputs[:, i:])
-            predicted_value = predicted_value[:, -1:]
-            predicted_value = torch.remainder(predicted_value, 1.0)
-            inputs = torch.cat([inputs, predicted_value], axis=1)
-
-        predicted = inputs[:, autoregression_seed:]
+        predicted = self.rollout(inputs, autoregression_steps)
 
         targets = targets.to(self.dtype)
         loss = self.loss(predicted, targets)
@@ -152,36 +332,77 @@ class BaseRNN(pl.LightningModule):
         )
         return loss
 
-    def predict_step(self, batch, _) -> dict[str, torch.Tensor]:
-        data, spectrum = batch
-        predicted: torch.Tensor = data[:, : self.regression_seed]
-        targets: torch.Tensor = data[:, self.regression_seed :]
+    def on_predict_epoch_start(self) -> None:
+        """
+        Prepares the output for predictions over all batches of the predict dataloader.
 
-        pbar = pyprind.ProgBar(
-            iterations=data.shape[1] - predicted.shape[1],
+        Note: Batches are rolled out one at a time and written into one preallocated output (a .npy memmap if
+        predict_output is set), loss and accuracy are aggregated over batches, so memory is bounded by the batch size.
+        """
+        dataloader = self.trainer.predict_dataloaders
+        dataset = dataloader.dataset
+        steps = dataset.data.shape[1] - self.regression_seed
+
+        # predicted.shape = targets.shape = [num_paths, steps, 2]
+        shape = (len(dataset), steps, dataset.data.shape[2])
+        self._predicted_memmap: Optional[np.memmap] = None
+        if self.predict_output is not None:
+            self._predicted_memmap = np.lib.format.open_memmap(
+                self.predict_output,
+                mode="w+",
+                dtype=torch.empty(0, dtype=self.dtype).numpy().dtype,
+                shape=shape,
+            )
+            self._predicted = torch.from_numpy(self._predicted_memmap)
+        else:
+            self._predicted = torch.empty(shape, dtype=self.dtype)
+        self._targets = dataset.data[:, self.regression_seed :]
+        self._spectrum = dataset.spectrum
+
+        # running sums of per batch loss and accuracy, weighted by the number of paths
+        self._predict_totals = {"loss": 0.0, "accuracy": 0.0, "paths": 0}
+
+        self._predict_pbar = pyprind.ProgBar(
+            iterations=steps * len(dataloader),
             bar_char="█",
             title="Predicting",
         )
 
-        for i in range(data.shape[1] - predicted.shape[1]):
-            predicted_value = self(predicted[:, i:])
-            predicted_value = predicted_value[:, -1:]
-            predicted_value = torch.remainder(predicted_value, 1.0)
-            predicted = torch.cat([predicted, predicted_value], axis=1)
-
-            pbar.update()
+    def predict_step(self, batch, _) -> dict[str, torch.Tensor]:
+        data, _ = batch
+        # cast once here, so that no casting happens inside the autoregression loop
+        data = data.to(self.dtype)
+        seed: torch.Tensor = data[:, : self.regression_seed]
+        targets: torch.Tensor = data[:, self.regression_seed :]
 
-        predicted = predicted[:, self.regression_seed :]
+        predicted = self.rollout(seed, targets.shape[1], pbar=self._predict_pbar)
 
+        # loss and accuracy are means over paths, so the weighted sums give the values over all paths
         loss = self.loss(predicted, targets)
         accuracy = self.accuracy(predicted, targets)
 
-        return {
-            "predicted": predicted,
-            "targets": targets,
-            "spectrum": spectrum,
-            "loss": loss,
-            "accuracy": accuracy,
+        start = self._predict_totals["paths"]
+        self._predicted[start : start + predicted.shape[0]] = predicted.cpu()
+        self._predict_totals["loss"] += loss.item() * predicted.shape[0]
+        self._predict_totals["accuracy"] += accuracy.item() * predicted.shape[0]
+        self._predict_totals["paths"] += predicted.shape[0]
+
+        return {"loss": loss, "accuracy": accuracy}
+
+    def on_predict_epoch_end(self) -> None:
+        """
+        Sets predictions, the same dict a single batch over all paths would give.
+        """
+        paths = self._predict_totals["paths"]
+        if self._predicted_memmap is not None:
+            self._predicted_memmap.flush()
+
+        self.predictions = {
+            "predicted": self._predicted,
+            "targets": self._targets.to(self.dtype),
+            "spectrum": self._spectrum,
+            "loss": torch.tensor(self._predict_totals["loss"] / paths),
+            "accuracy": torch.tensor(self._predict_totals["accuracy"] / paths),
         }
 
     @rank_zero_only
@@ -203,71 +424,163 @@ class BaseRNN(pl.LightningModule):
 
 
 class ResidualRNNCell(nn.Module):
+    """
+    Note: The recurrent weights are packed as weight_hh = [weight_2, weight_3], so that on bypass steps
+    the hidden state and the delayed input are multiplied in one GEMM.
+    """
+
     def __init__(self, input_size, hidden_size):
         super(ResidualRNNCell, self).__init__()
+        self.hidden_size = hidden_size
 
-        self.weight_1 = nn.Parameter(torch.Tensor(hidden_size, input_size))
-        self.weight_2 = nn.Parameter(torch.Tensor(hidden_size, hidden_size))
-        self.weight_3 = nn.Parameter(torch.Tensor(hidden_size, hidden_size))
+        self.weight_ih = nn.Parameter(torch.Tensor(hidden_size, input_size))
+        self.weight_hh = nn.Parameter(torch.Tensor(hidden_size, 2 * hidden_size))
         self.bias = nn.Parameter(torch.Tensor(hidden_size))
 
         self.reset_parameters()
+        self._register_load_state_dict_pre_hook(self._pack_weights)
 
     def reset_parameters(self):
-        nn.init.kaiming_uniform_(self.weight_1)
-        nn.init.kaiming_uniform_(self.weight_2)
-        nn.init.kaiming_uniform_(self.weight_3)
+        # same initialization as separate weight_1, weight_2 and weight_3
+        nn.init.kaiming_uniform_(self.weight_ih)
+        with torch.no_grad():
+            nn.init.kaiming_uniform_(self.weight_hh[:, : self.hidden_size])
+            nn.init.kaiming_uniform_(self.weight_hh[:, self.hidden_size :])
         nn.init.zeros_(self.bias)
 
-    def forward(self, input1, input2, delayed_input=None):
-        output = F.linear(input1, self.weight_1, self.bias)
-        output += F.linear(input2, self.weight_2)
+    def input_projection(self, input1):
+        return F.linear(input1, self.weight_ih, self.bias)
 
-        if delayed_input is not None:
-            output += F.linear(delayed_input, self.weight_3)
+    def recurrence(self, input_projection, input2, delayed_input=None):
+        if delayed_input is None:
+            output = torch.addmm(
+                input_projection, input2, self.weight_hh[:, : self.hidden_size].t()
+            )
+        else:
+            output = torch.addmm(
+                input_projection,
+                torch.cat([input2, delayed_input], dim=-1),
+                self.weight_hh.t(),
+            )
 
         output = F.tanh(output)
 
         return output
 
+    def forward(self, input1, input2, delayed_input=None):
+        return self.recurrence(self.input_projection(input1), input2, delayed_input)
+
+    def forward_sequence(self, inputs, input2, delayed_input, bypass_n_steps):
+        """
+        inputs.shape = [seq_len, batch_size, input_size], returns outputs.shape = [seq_len, batch_size, hidden_size]
+        """
+        # input projections for the whole sequence in one batched matmul
+        input_projections = self.input_projection(inputs)
+
+        outputs = []
+        for t in range(inputs.shape[0]):
+            if (t + 1) % bypass_n_steps == 0:
+                input2 = self.recurrence(input_projections[t], input2, delayed_input)
+                delayed_input = input2.detach().clone()
+            else:
+                input2 = self.recurrence(input_projections[t], input2)
+            outputs.append(input2)
+
+        return torch.stack(outputs)
+
+    def _pack_weights(self, state_dict, prefix, *args):
+        # checkpoints from before the weights were packed
+        if f"{prefix}weight_1" in state_dict:
+            state_dict[f"{prefix}weight_ih"] = state_dict.pop(f"{prefix}weight_1")
+            state_dict[f"{prefix}weight_hh"] = torch.cat(
+                [
+                    state_dict.pop(f"{prefix}weight_2"),
+                    state_dict.pop(f"{prefix}weight_3"),
+                ],
+                dim=1,
+            )
+
 
 class MinimalGatedCell(nn.Module):
+    """
+    Note: The input weights of the forget gate and candidate activation are packed as
+    weight_x = [weight_fx, weight_hx], so input projections take one GEMM and can be computed for the whole sequence at once.
+    """
+
     def __init__(self, input_size, hidden_size):
         super(MinimalGatedCell, self).__init__()
+        self.hidden_size = hidden_size
 
-        # Parameters for forget gate
-        self.weight_fx = nn.Parameter(torch.Tensor(hidden_size, input_size))
+        # Input parameters for forget gate and candidate activation
+        self.weight_x = nn.Parameter(torch.Tensor(2 * hidden_size, input_size))
+        self.bias_x = nn.Parameter(torch.Tensor(2 * hidden_size))
+
+        # Recurrent parameters for forget gate
         self.weight_fh = nn.Parameter(torch.Tensor(hidden_size, hidden_size))
-        self.bias_f = nn.Parameter(torch.Tensor(hidden_size))
 
-        # Parameters for candidate activation
-        self.weight_hx = nn.Parameter(torch.Tensor(hidden_size, input_size))
+        # Recurrent parameters for candidate activation
         self.weight_hf = nn.Parameter(torch.Tensor(hidden_size, hidden_size))
-        self.bias_h = nn.Parameter(torch.Tensor(hidden_size))
 
         self.reset_parameters()
+        self._register_load_state_dict_pre_hook(self._pack_weights)
 
     def reset_parameters(self):
-        nn.init.kaiming_uniform_(self.weight_fx)
-        nn.init.kaiming_uniform_(self.weight_fh)
-        nn.init.zeros_(self.bias_f)
-
-        nn.init.kaiming_uniform_(self.weight_hx)
+        # same initialization as separate forget gate and candidate activation weights
+        with torch.no_grad():
+            nn.init.kaiming_uniform_(self.weight_x[: self.hidden_size])
+            nn.init.kaiming_uniform_(self.weight_fh)
+            nn.init.kaiming_uniform_(self.weight_x[self.hidden_size :])
         nn.init.kaiming_uniform_(self.weight_hf)
-        nn.init.zeros_(self.bias_h)
+        nn.init.zeros_(self.bias_x)
+
+    def input_projection(self, input1):
+        return F.linear(input1, self.weight_x, self.bias_x)
+
+    def recurrence(self, input_projection, input2):
+        f_x, h_x = input_projection.chunk(2, dim=-1)
 
-    def forward(self, input1, input2):
         # Compute forget gate
-        f_t = F.linear(input1, self.weight_fx, self.bias_f)
-        f_t += F.linear(input2, self.weight_fh)
+        f_t = torch.addmm(f_x, input2, self.weight_fh.t())
         f_t = F.sigmoid(f_t)
 
         # Compute candidate activation
-        h_hat_t = F.linear(input1, self.weight_hx, self.bias_h)
-        h_hat_t += F.linear(f_t * input2, self.weight_hf)
+        h_hat_t = torch.addmm(h_x, f_t * input2, self.weight_hf.t())
         h_hat_t = F.tanh(h_hat_t)
 
         # Compute output
         h_t = (1 - f_t) * input2 + f_t * h_hat_t
 
         return h_t
+
+    def forward(self, input1, input2):
+        return self.recurrence(self.input_projection(input1), input2)
+
+    def forward_sequence(self, inputs, input2):
+        """
+        inputs.shape = [seq_len, batch_size, input_size], returns outputs.shape = [seq_len, batch_size, hidden_size]
+        """
+        # input projections for the whole sequence in one batched matmul
+        input_projections = self.input_projection(inputs)
+
+        outputs = []
+        for t in range(inputs.shape[0]):
+            input2 = self.recurrence(input_projections[t], input2)
+            outputs.append(input2)
+
+        return torch.stack(outputs)
+
+    def _pack_weights(self, state_dict, prefix, *args):
+        # checkpoints from before the weights were packed
+        if f"{prefix}weight_fx" in state_dict:
+            state_dict[f"{prefix}weight_x"] = torch.cat(
+                [
+                    state_dict.pop(f"{prefix}weight_fx"),
+                    state_dict.pop(f"{prefix}weight_hx"),
+                ]
+            )
+            state_dict[f"{prefix}bias_x"] = torch.cat(
+                [
+                    state_dict.pop(f"{prefix}bias_f"),
+                    state_dict.pop(f"{prefix}bias_h"),
+                ]
+            )
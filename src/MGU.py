@@ -1,12 +1,10 @@
 import torch
 import torch.nn as nn
-from src.utils import conditional_torch_compile
+from typing import List, Tuple
 from src.BaseRNN import BaseRNN, MinimalGatedCell
 
 
 class MGU(BaseRNN):
-    compile_model = False
-
     def __init__(self, **params):
         super(MGU, self).__init__(**params)
 
@@ -18,35 +16,31 @@ class MGU(BaseRNN):
                 MinimalGatedCell(self.hidden_sizes[layer], self.hidden_sizes[layer + 1])
             )
 
-        if MGU.compile_model:
-            for layer in range(self.num_rnn_layers):
-                self.rnns[layer] = torch.compile(self.rnns[layer], dynamic=False)
-
-        self.create_linear_layers(MGU.compile_model)
+        self.create_linear_layers()
 
-    @conditional_torch_compile(compile_model, dynamic=False)
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = x.to(self.dtype)
         x = x.transpose(0, 1)
         seq_len, batch_size, _ = x.size()
 
         # h_ts[i].shape = [batch_size, hidden_sizes[i]]
-        h_ts = self._init_hidden(batch_size, self.hidden_sizes)
+        h_ts = self.init_state(batch_size)
 
-        outputs = []
-        # rnn layers
-        for t in range(seq_len):
-            h_ts[0] = self.rnns[0](x[t], h_ts[0])
-            for layer in range(1, self.num_rnn_layers):
-                h_ts[layer] = self.rnns[layer](h_ts[layer - 1], h_ts[layer])
-            outputs.append(h_ts[-1])
+        # rnn layers, one layer at a time over the whole sequence, so that each
+        # layer computes its input projections in one batched matmul
+        outputs = x
+        for layer in range(self.num_rnn_layers):
+            outputs = self.rnns[layer].forward_sequence(outputs, h_ts[layer])
 
-        outputs = torch.stack(outputs)
         outputs = outputs.transpose(0, 1)
 
-        # linear layers
-        for layer in range(self.num_lin_layers):
-            outputs = self.lins[layer](outputs)
-            outputs = self.nonlin_lin(outputs)
+        return self.linear_forward(outputs)
+
+    def step(
+        self, x_t: torch.Tensor, h_ts: List[torch.Tensor]
+    ) -> Tuple[torch.Tensor, List[torch.Tensor]]:
+        # h_ts[i].shape = [batch_size, hidden_sizes[i]]
+        new_h_ts = [self.rnns[0](x_t, h_ts[0])]
+        for layer in range(1, self.num_rnn_layers):
+            new_h_ts.append(self.rnns[layer](new_h_ts[layer - 1], h_ts[layer]))
 
-        return outputs
+        return new_h_ts[-1], new_h_ts
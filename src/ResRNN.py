@@ -1,12 +1,10 @@
 import torch
 import torch.nn as nn
-from src.utils import conditional_torch_compile
+from typing import List, Tuple
 from src.BaseRNN import BaseRNN, ResidualRNNCell
 
 
 class ResRNN(BaseRNN):
-    compile_model = False
-
     def __init__(self, **params):
         super(ResRNN, self).__init__(**params)
         self.bypass_n_steps = params.get("bypass_n_steps")
@@ -19,47 +17,55 @@ class ResRNN(BaseRNN):
                 ResidualRNNCell(self.hidden_sizes[layer - 1], self.hidden_sizes[layer])
             )
 
-        if ResRNN.compile_model:
-            for layer in range(self.num_rnn_layers):
-                self.rnns[layer] = torch.compile(self.rnns[layer], dynamic=False)
-
-        self.create_linear_layers(ResRNN.compile_model)
+        self.create_linear_layers()
 
-    @conditional_torch_compile(compile_model, dynamic=False)
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = x.to(self.dtype)
         x = x.transpose(0, 1)
         seq_len, batch_size, _ = x.size()
 
         # h_ts[i].shape = [batch_size, hidden_sizes[i]]
-        h_ts = self._init_hidden(batch_size, self.hidden_sizes)
+        h_ts, delayed_input, _ = self.init_state(batch_size)
+
+        # rnn layers, one layer at a time over the whole sequence, so that each
+        # layer computes its input projections in one batched matmul
+        outputs = x
+        for layer in range(self.num_rnn_layers):
+            outputs = self.rnns[layer].forward_sequence(
+                outputs, h_ts[layer], delayed_input[layer], self.bypass_n_steps
+            )
+
+        outputs = outputs.transpose(0, 1)
 
-        outputs = []
+        return self.linear_forward(outputs)
+
+    def init_state(
+        self, batch_size: int
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor], int]:
+        # h_ts[i].shape = [batch_size, hidden_sizes[i]]
+        h_ts = self._init_hidden(batch_size, self.hidden_sizes)
         delayed_input = [h_t.detach().clone() for h_t in h_ts]
-        # rnn layers
-        for t in range(seq_len):
-            if (t + 1) % self.bypass_n_steps == 0:
-                h_ts[0] = self.rnns[0](x[t], h_ts[0], delayed_input[0])
-                delayed_input[0] = h_ts[0].detach().clone()
-            else:
-                h_ts[0] = self.rnns[0](x[t], h_ts[0])
 
-            for layer in range(1, self.num_rnn_layers):
-                if (t + 1) % self.bypass_n_steps == 0:
-                    h_ts[layer] = self.rnns[layer](
-                        h_ts[layer - 1], h_ts[layer], delayed_input[layer]
-                    )
-                    delayed_input[layer] = h_ts[layer].detach().clone()
-                else:
-                    h_ts[layer] = self.rnns[layer](h_ts[layer - 1], h_ts[layer])
-            outputs.append(h_ts[-1])
+        # the timestep decides when the delayed input is used
+        return h_ts, delayed_input, 0
 
-        outputs = torch.stack(outputs)
-        outputs = outputs.transpose(0, 1)
+    def step(
+        self,
+        x_t: torch.Tensor,
+        state: Tuple[List[torch.Tensor], List[torch.Tensor], int],
+    ) -> Tuple[torch.Tensor, Tuple[List[torch.Tensor], List[torch.Tensor], int]]:
+        h_ts, delayed_input, t = state
+        bypass = (t + 1) % self.bypass_n_steps == 0
 
-        # linear layers
-        for layer in range(self.num_lin_layers):
-            outputs = self.lins[layer](outputs)
-            outputs = self.nonlin_lin(outputs)
+        new_h_ts = []
+        new_delayed_input = list(delayed_input)
+        for layer in range(self.num_rnn_layers):
+            layer_input = x_t if layer == 0 else new_h_ts[layer - 1]
+            if bypass:
+                new_h_ts.append(
+                    self.rnns[layer](layer_input, h_ts[layer], delayed_input[layer])
+                )
+                new_delayed_input[layer] = new_h_ts[layer].detach().clone()
+            else:
+                new_h_ts.append(self.rnns[layer](layer_input, h_ts[layer]))
 
-        return outputs
+        return new_h_ts[-1], (new_h_ts, new_delayed_input, t + 1)
@@ -1,58 +1,91 @@
 import torch
 import torch.nn as nn
+from typing import List, Tuple
 from src.BaseRNN import BaseRNN
-from src.utils import conditional_torch_compile
 
 
 class Vanilla(BaseRNN):
-    compile_model = False
-
     def __init__(self, **params):
         super(Vanilla, self).__init__(**params)
 
-        # Create the rnn layers
-        self.rnns = nn.ModuleList([])
-        self.rnns.append(
-            nn.RNNCell(2, self.hidden_sizes[0], nonlinearity=self.nonlin_hidden)
+        # NOTE: a stack of equally sized RNNCells is the same as a multi-layer nn.RNN,
+        # which runs the whole sequence in one fused (cuDNN/oneDNN) kernel
+        self.fused: bool = (
+            params.get("fused_rnn", True)
+            and len(set(self.hidden_sizes)) == 1
+            and self.nonlin_hidden in ["tanh", "relu"]
         )
-        for layer in range(self.num_rnn_layers - 1):
+
+        # Create the rnn layers
+        if self.fused:
+            self.rnn = nn.RNN(
+                2,
+                self.hidden_sizes[0],
+                num_layers=self.num_rnn_layers,
+                nonlinearity=self.nonlin_hidden,
+                batch_first=True,
+            )
+        else:
+            self.rnns = nn.ModuleList([])
             self.rnns.append(
-                nn.RNNCell(
-                    self.hidden_sizes[layer],
-                    self.hidden_sizes[layer + 1],
-                    nonlinearity=self.nonlin_hidden,
-                )
+                nn.RNNCell(2, self.hidden_sizes[0], nonlinearity=self.nonlin_hidden)
             )
+            for layer in range(self.num_rnn_layers - 1):
+                self.rnns.append(
+                    nn.RNNCell(
+                        self.hidden_sizes[layer],
+                        self.hidden_sizes[layer + 1],
+                        nonlinearity=self.nonlin_hidden,
+                    )
+                )
 
-        if Vanilla.compile_model:
-            for layer in range(self.num_rnn_layers):
-                self.rnns[layer] = torch.compile(self.rnns[layer], dynamic=False)
+        # checkpoints of either layout can be loaded into either layout
+        self._register_load_state_dict_pre_hook(self._convert_rnn_weights)
 
-        self.create_linear_layers(Vanilla.compile_model)
+        self.create_linear_layers()
 
-    @conditional_torch_compile(compile_model, dynamic=False)
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = x.to(self.dtype)
-        x = x.transpose(0, 1)
-        seq_len, batch_size, _ = x.size()
+        if not self.fused:
+            return super(Vanilla, self).forward(x)
 
-        # h_ts[i].shape = [batch_size, hidden_sizes[i]]
-        h_ts = self._init_hidden(batch_size, self.hidden_sizes)
+        # outputs.shape = [batch_size, seq_len, hidden_sizes[-1]]
+        outputs, _ = self.rnn(x)
+
+        return self.linear_forward(outputs)
 
-        outputs = []
-        # rnn layers
-        for t in range(seq_len):
-            h_ts[0] = self.rnns[0](x[t], h_ts[0])
-            for layer in range(1, self.num_rnn_layers):
-                h_ts[layer] = self.rnns[layer](h_ts[layer - 1], h_ts[layer])
-            outputs.append(h_ts[-1])
+    def init_state(self, batch_size: int) -> List[torch.Tensor] | torch.Tensor:
+        if not self.fused:
+            return super(Vanilla, self).init_state(batch_size)
+
+        # h_ts.shape = [num_rnn_layers, batch_size, hidden_size]
+        return torch.zeros(
+            self.num_rnn_layers, batch_size, self.hidden_sizes[0], device=self.device
+        )
+
+    def step(
+        self, x_t: torch.Tensor, h_ts: List[torch.Tensor] | torch.Tensor
+    ) -> Tuple[torch.Tensor, List[torch.Tensor] | torch.Tensor]:
+        if self.fused:
+            output, h_ts = self.rnn(x_t.unsqueeze(1), h_ts)
+            return output[:, 0], h_ts
+
+        # h_ts[i].shape = [batch_size, hidden_sizes[i]]
+        new_h_ts = [self.rnns[0](x_t, h_ts[0])]
+        for layer in range(1, self.num_rnn_layers):
+            new_h_ts.append(self.rnns[layer](new_h_ts[layer - 1], h_ts[layer]))
 
-        outputs = torch.stack(outputs)
-        outputs = outputs.transpose(0, 1)
+        return new_h_ts[-1], new_h_ts
 
-        # linear layers
-        for layer in range(self.num_lin_layers):
-            outputs = self.lins[layer](outputs)
-            outputs = self.nonlin_lin(outputs)
+    def _convert_rnn_weights(self, state_dict: dict, prefix: str, *args) -> None:
+        """
+        Renames RNNCell weights (rnns.{layer}.{name}) to nn.RNN weights (rnn.{name}_l{layer}) or vice versa.
+        """
+        for layer in range(self.num_rnn_layers):
+            for name in ["weight_ih", "weight_hh", "bias_ih", "bias_hh"]:
+                cell_key = f"{prefix}rnns.{layer}.{name}"
+                fused_key = f"{prefix}rnn.{name}_l{layer}"
 
-        return outputs
+                if self.fused and cell_key in state_dict:
+                    state_dict[fused_key] = state_dict.pop(cell_key)
+                elif not self.fused and fused_key in state_dict:
+                    state_dict[cell_key] = state_dict.pop(fused_key)
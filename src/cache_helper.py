@@ -0,0 +1,148 @@
+import numpy as np
+from argparse import ArgumentParser
+from typing import Dict, List, Optional
+import hashlib
+import json
+import shutil
+import time
+import os
+
+try:
+    from src.utils import read_yaml, save_yaml
+except ModuleNotFoundError:
+    from utils import read_yaml, save_yaml
+
+
+class DatasetCache:
+    """
+    Content-addressed on-disk cache of generated trajectories.
+
+    Every entry is a directory named by the hash of the parameters that produced it. It holds one .npy file
+    per array and a metadata.yaml with those parameters.
+
+    Note: Entries are evicted least recently used first once the cache is larger than max_size_gb.
+    """
+
+    def __init__(self, cache_dir: str, max_size_gb: float = 20.0) -> None:
+        self.cache_dir = cache_dir
+        self.max_size: int = int(max_size_gb * 1024**3)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        serialized = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()[:32]
+
+    def load(self, key: str, names: List[str]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Returns the arrays of an entry as copy-on-write memmaps, or None if the entry is missing.
+        """
+        entry_path = os.path.join(self.cache_dir, key)
+
+        if not all(
+            os.path.isfile(os.path.join(entry_path, f"{name}.npy")) for name in names
+        ):
+            return None
+
+        # mark entry as recently used
+        os.utime(entry_path)
+
+        return {
+            name: np.load(os.path.join(entry_path, f"{name}.npy"), mmap_mode="c")
+            for name in names
+        }
+
+    def save(self, key: str, arrays: Dict[str, np.ndarray], metadata: dict) -> None:
+        entry_path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_path):
+            return
+
+        # write to a temporary directory first, so that concurrent runs never see partial entries
+        tmp_path = f"{entry_path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        save_yaml(
+            {"created": time.ctime(), **metadata},
+            os.path.join(tmp_path, "metadata.yaml"),
+        )
+
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # another run saved the same entry in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+
+    def info(self) -> List[dict]:
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, key)
+            if not os.path.isdir(entry_path) or ".tmp-" in key:
+                continue
+
+            metadata_path = os.path.join(entry_path, "metadata.yaml")
+            entries.append(
+                {
+                    "key": key,
+                    "size": sum(
+                        os.path.getsize(os.path.join(entry_path, file))
+                        for file in os.listdir(entry_path)
+                    ),
+                    "last_used": os.path.getmtime(entry_path),
+                    "metadata": (
+                        read_yaml(metadata_path)
+                        if os.path.isfile(metadata_path)
+                        else {}
+                    ),
+                }
+            )
+
+        # least recently used first
+        entries.sort(key=lambda entry: entry["last_used"])
+        return entries
+
+    def evict(self) -> None:
+        entries = self.info()
+        total_size = sum(entry["size"] for entry in entries)
+
+        # always keep the most recently used entry
+        for entry in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(
+                os.path.join(self.cache_dir, entry["key"]), ignore_errors=True
+            )
+            total_size -= entry["size"]
+
+    def clear(self) -> None:
+        for key in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="Dataset cache")
+    parser.add_argument("--path", type=str, help="Path to the cache directory.")
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Remove all cached entries. (default: False)",
+    )
+    args = parser.parse_args()
+
+    cache = DatasetCache(args.path)
+
+    if args.clear:
+        cache.clear()
+
+    entries = cache.info()
+    for entry in entries:
+        print(
+            f"{entry['key']}  {entry['size'] / 1024**2:10.1f} MB  last used {time.ctime(entry['last_used'])}  {entry['metadata']}"
+        )
+    print(
+        f"{len(entries)} entries, {sum(entry['size'] for entry in entries) / 1024**3:.2f} GB in total."
+    )
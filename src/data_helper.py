@@ -1,13 +1,17 @@
 import torch
 import pytorch_lightning as pl
+from pytorch_lightning.utilities import rank_zero_only
 from torch.utils.data import DataLoader
 
 import numpy as np
-from typing import Tuple, List, Optional
+from typing import Tuple, List, Optional, Iterator, Any
 import warnings
+import threading
+import queue
 import os
 
-from src.mapping_helper import StandardMap
+from src.mapping_helper import StandardMap, TorchStandardMap
+from src.cache_helper import DatasetCache
 
 
 class Data(pl.LightningDataModule):
@@ -21,6 +25,7 @@ class Data(pl.LightningDataModule):
         params: dict = None,
         train_size: float = 1.0,
         plot_data: bool = False,
+        cache: Optional[DatasetCache] = None,
     ) -> None:
         super(Data, self).__init__()
         self.seq_len: int = params.get("seq_length")
@@ -29,16 +34,60 @@ class Data(pl.LightningDataModule):
         self.shuffle_trajectories: bool = params.get("shuffle_trajectories")
         self.shuffle_within_batches: bool = params.get("shuffle_within_batches")
         self.drop_last: bool = params.get("drop_last")
+        # NOTE: if True, whole index batches are sampled and gathered at once
+        self.batch_sampler: bool = params.get("batch_sampler", False)
+        # NOTE: workers and pinned memory only apply to datasets in host memory
+        self.num_workers: int = params.get("num_workers", 0)
+        self.pin_memory: bool = params.get("pin_memory", False)
+        self.persistent_workers: bool = params.get("persistent_workers", True)
+        self.prefetch_factor: int = params.get("prefetch_factor", 2)
+        # NOTE: trajectories rolled out at once in predict, if None all of them
+        self.predict_batch_size: Optional[int] = params.get("predict_batch_size")
         val_reg_preds: int = params.get("val_reg_preds")
+        # data is stored in the training dtype once, so batches need no further casting
+        self.dtype: np.dtype = np.dtype(params.get("dtype") or "float32")
         self.rng: np.random.Generator = np.random.default_rng(seed=42)
 
+        # NOTE: a map without a seed can't be cached, its data is different every time
+        # NOTE: a TorchStandardMap keeps its data on device, it is cheaper to regenerate than to cache
+        if (
+            map_object is None
+            or map_object.seed is None
+            or isinstance(map_object, TorchStandardMap)
+        ):
+            cache = None
+
+        # NOTE: in online mode training windows are streamed from freshly generated trajectories
+        self.online_training: bool = params.get("online_training", False)
+        if self.online_training:
+            self.train_dataset = StreamingDataset(
+                map_object,
+                self.seq_len,
+                1,
+                self.batch_size,
+                self.dtype,
+                every_n_step=self.every_n_step,
+                shuffle=self.shuffle_within_batches,
+                batches_per_epoch=params.get("batches_per_epoch"),
+                prefetch=params.get("stream_prefetch", 2),
+            )
+            self.validation_dataset = Dataset(
+                np.empty((0, self.seq_len + val_reg_preds, 2), dtype=self.dtype),
+                self.seq_len,
+                val_reg_preds,
+                self.dtype,
+            )
+            self.train_dataset.print_info("training")
+            return
+
         # generate new data
         if map_object is not None:
-            map_object.generate_data()
-            thetas, ps = map_object.retrieve_data()
+            # data.shape = [init_points, steps, 2]
+            # NOTE: this is a view (or memmap, or tensor) of the map's output, it is never copied here
+            self.data = self._retrieve_trajectories(map_object, cache)
 
             # fake spectrum
-            self.spectrum = self.rng.choice([0, 1], size=thetas.shape[1])
+            self.spectrum = self.rng.choice([0, 1], size=self.data.shape[0])
             self.reverse_indices = None
 
         # load data
@@ -59,126 +108,197 @@ class Data(pl.LightningDataModule):
             thetas = thetas[:steps, :init_points]
             ps = ps[:steps, :init_points]
 
+            # data.shape = [init_points, steps, 2]
+            self.data = np.stack([thetas.T, ps.T], axis=-1).astype(
+                self.dtype, copy=False
+            )
+
         if plot_data:
             map_object.plot_data()
 
-        # data.shape = [init_points, steps, 2]
-        self.data = np.stack([thetas.T, ps.T], axis=-1)
-
         # take every n-th step
         # assert (self.data.shape[1] // self.every_n_step) >= (
         # self.seq_len + val_reg_preds
         # ), f"take steps >= {(self.seq_len + val_reg_preds)*self.every_n_step}"
         self.data = self.data[:, :: self.every_n_step]
 
-        # shuffle trajectories
+        # shuffle trajectories through an index array, so that self.data (possibly
+        # a read-only memmap) is left untouched
+        self.trajectory_order = np.arange(len(self.data))
         if self.shuffle_trajectories:
-            self.rng.shuffle(self.data)
+            self.rng.shuffle(self.trajectory_order)
 
         t = int(len(self.data) * train_size)
 
+        # NOTE: datasets only keep self.data and trajectory indices, windows are gathered when indexed
         if train_size > 0.0:
-            train_sequences = self._make_sequences(self.data[:t], 1)
-            self.train_pairs = self._make_input_output_pairs(train_sequences, 1)
+            self.train_dataset = Dataset(
+                self.data,
+                self.seq_len,
+                1,
+                self.dtype,
+                trajectory_indices=self.trajectory_order[:t],
+            )
 
         if train_size < 1.0:
-            validation_sequences = self._make_sequences(self.data[t:], val_reg_preds)
-            self.validation_pairs = self._make_input_output_pairs(
-                validation_sequences, val_reg_preds
+            self.validation_dataset = Dataset(
+                self.data,
+                self.seq_len,
+                val_reg_preds,
+                self.dtype,
+                trajectory_indices=self.trajectory_order[t:],
             )
         else:
-            self.validation_pairs = np.array([])
+            self.validation_dataset = Dataset(
+                np.empty((0, self.seq_len + val_reg_preds, 2), dtype=self.dtype),
+                self.seq_len,
+                val_reg_preds,
+                self.dtype,
+            )
 
         self.print_info(train_size)
 
     def print_info(self, train_size: float) -> None:
         if 0.0 < train_size < 1.0:
             if (
-                len(self.train_pairs) < self.batch_size
-                or len(self.validation_pairs) < self.batch_size
+                len(self.train_dataset) < self.batch_size
+                or len(self.validation_dataset) < self.batch_size
             ):
                 warnings.warn(
                     f"Batch size ({self.batch_size}) is larger than the number of training or validation pairs. Is drop_last set to True?"
                 )
 
-            print(
-                f"{len(self.train_pairs)} training pairs of shape ({self.train_pairs[0][0].shape[0]}, {self.train_pairs[0][1].shape[0]})."
-            )
-            print(
-                f"{len(self.validation_pairs)} validation pairs of shape ({self.validation_pairs[0][0].shape[0]}, {self.validation_pairs[0][1].shape[0]})."
-            )
+            self.train_dataset.print_info("training")
+            self.validation_dataset.print_info("validation")
         elif train_size == 0.0:
-            if len(self.validation_pairs) < self.batch_size:
+            if len(self.validation_dataset) < self.batch_size:
                 warnings.warn(
                     f"Batch size ({self.batch_size}) is larger than the number of training or validation pairs. Is drop_last set to True?"
                 )
-            print(
-                f"{len(self.validation_pairs)} validation pairs of shape ({self.validation_pairs[0][0].shape[0]}, {self.validation_pairs[0][1].shape[0]})."
-            )
+            self.validation_dataset.print_info("validation")
         else:
-            if len(self.train_pairs) < self.batch_size:
+            if len(self.train_dataset) < self.batch_size:
                 warnings.warn(
                     "Batch size is larger than the number of training pairs. Is drop_last set to True?"
                 )
 
-            print(
-                f"{len(self.train_pairs)} training pairs of shape ({self.train_pairs[0][0].shape[0]}, {self.train_pairs[0][1].shape[0]})."
-            )
+            self.train_dataset.print_info("training")
 
-    def _make_sequences(self, data: np.ndarray, val_reg_preds: int) -> np.ndarray:
-        init_points: int
-        steps: int
-        features: int
-        init_points, steps, features = data.shape
+    @staticmethod
+    def _retrieve_trajectories(
+        map_object: StandardMap, cache: Optional[DatasetCache]
+    ) -> np.ndarray:
+        if cache is None:
+            map_object.generate_data()
+            return map_object.retrieve_trajectories()
 
-        if self.seq_len >= steps:
-            sequences = data
-        else:
-            # sequences.shape = [init_points * (steps - seq_len), seq_len + val_reg_preds, features]
-            sequences = np.lib.stride_tricks.sliding_window_view(
-                data, (1, self.seq_len + val_reg_preds, features)
-            )
-            sequences = sequences.reshape(
-                init_points * (steps - self.seq_len - val_reg_preds + 1),
-                self.seq_len + val_reg_preds,
-                features,
-            )
+        key = DatasetCache.make_key(map_object.get_params())
+        cached = cache.load(key, ["trajectories"])
 
-        return sequences
+        if cached is None:
+            map_object.generate_data()
+            cache.save(
+                key,
+                {"trajectories": map_object.retrieve_trajectories()},
+                map_object.get_params(),
+            )
+        else:
+            print("Loaded trajectories from cache.")
+            map_object.trajectories = cached["trajectories"]
 
-    def _make_input_output_pairs(
-        self, sequences, val_reg_preds: int
-    ) -> List[Tuple[np.ndarray]]:
-        return [(seq[:-val_reg_preds], seq[-val_reg_preds:]) for seq in sequences]
+        return map_object.retrieve_trajectories()
 
     def train_dataloader(self) -> DataLoader:
+        if self.online_training:
+            # StreamingDataset yields whole batches
+            return DataLoader(
+                self.train_dataset,
+                batch_size=None,
+                collate_fn=_collate_batch,
+                **self._dataloader_kwargs(self.train_dataset),
+            )
+
+        if self.batch_sampler:
+            return DataLoader(
+                self.train_dataset,
+                batch_size=None,
+                sampler=BatchIndexSampler(
+                    len(self.train_dataset),
+                    batch_size=self.batch_size,
+                    shuffle=self.shuffle_within_batches,
+                    drop_last=self.drop_last,
+                ),
+                collate_fn=_collate_batch,
+                **self._dataloader_kwargs(self.train_dataset),
+            )
+
         return DataLoader(
-            Dataset(self.train_pairs),
+            self.train_dataset,
             batch_size=self.batch_size,
             shuffle=self.shuffle_within_batches,
             drop_last=self.drop_last,
-            # pin_memory=True,
-            # num_workers=8,
-            # persistent_workers=True,
+            collate_fn=_collate_batch,
+            **self._dataloader_kwargs(self.train_dataset),
         )
 
     def val_dataloader(self) -> DataLoader:
+        if self.batch_sampler:
+            return DataLoader(
+                self.validation_dataset,
+                batch_size=None,
+                sampler=BatchIndexSampler(
+                    len(self.validation_dataset),
+                    batch_size=self.batch_size * 5,
+                    shuffle=False,
+                    drop_last=False,
+                ),
+                collate_fn=_collate_batch,
+                **self._dataloader_kwargs(self.validation_dataset),
+            )
+
         return DataLoader(
-            Dataset(self.validation_pairs),
+            self.validation_dataset,
             batch_size=self.batch_size * 5,
             drop_last=False,
-            # pin_memory=True,
-            # num_workers=8,
-            # persistent_workers=True,
+            collate_fn=_collate_batch,
+            **self._dataloader_kwargs(self.validation_dataset),
         )
 
     def predict_dataloader(self) -> torch.Tensor:
+        dataset = InferenceDataset(
+            torch.as_tensor(self.data[self.trajectory_order]),
+            self.spectrum,
+            self.dtype,
+        )
         return DataLoader(
-            InferenceDataset(torch.tensor(self.data), self.spectrum),
-            batch_size=int(1e6),
+            dataset,
+            batch_size=self.predict_batch_size or max(len(dataset), 1),
             shuffle=False,
+            **self._dataloader_kwargs(dataset),
         )
 
+    def _dataloader_kwargs(self, dataset: torch.utils.data.Dataset) -> dict:
+        if dataset.device.type != "cpu":
+            return {}
+
+        kwargs = {"num_workers": self.num_workers, "pin_memory": self.pin_memory}
+        if self.num_workers > 0:
+            kwargs.update(
+                {
+                    "persistent_workers": self.persistent_workers,
+                    "prefetch_factor": self.prefetch_factor,
+                }
+            )
+            # forked workers share the parent's pages, spawned ones need the data in shared memory
+            # NOTE: allow_none=True doesn't fix the start method, None means the platform default (listed first)
+            start_method = torch.multiprocessing.get_start_method(allow_none=True)
+            if start_method is None:
+                start_method = torch.multiprocessing.get_all_start_methods()[0]
+            if start_method != "fork" and hasattr(dataset, "share_memory_"):
+                dataset.share_memory_()
+
+        return kwargs
+
     @staticmethod
     def _load_data(
         path: str, K: List[float] | float, binary: bool
@@ -222,28 +342,342 @@ def _get_subdirectories(directory: str, K: List[float]) -> List[str]:
     return subdirectories
 
 
+def _to_torch_dtype(dtype: np.dtype) -> torch.dtype:
+    return torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+
+
+def _collate_batch(batch: Tuple[torch.Tensor]) -> Tuple[torch.Tensor]:
+    # Dataset.__getitems__ already returns whole batches
+    return batch
+
+
 class Dataset(torch.utils.data.Dataset):
-    def __init__(self, data: List[Tuple[np.ndarray]]):
-        self.data = data
+    """
+    Windows of length input_length + output_length over trajectories of shape [num_trajectories, steps, 2].
+
+    Note: Only the trajectories are stored, window i is gathered from trajectory trajectory_indices[i // windows_per_trajectory]
+    at offset i % windows_per_trajectory when indexed. A batch is gathered with a single indexing operation in __getitems__.
+    """
+
+    def __init__(
+        self,
+        trajectories: np.ndarray | torch.Tensor,
+        input_length: int,
+        output_length: int,
+        dtype: np.dtype = np.float32,
+        trajectory_indices: Optional[np.ndarray] = None,
+    ):
+        with warnings.catch_warnings():
+            # read-only memmaps are shared as is, windows are never written to
+            warnings.filterwarnings(
+                "ignore", message="The given NumPy array is not writable"
+            )
+            # no copy if trajectories are a numpy array or a tensor of the requested dtype
+            self.trajectories = torch.as_tensor(trajectories).to(
+                _to_torch_dtype(dtype)
+            )
+
+        if trajectory_indices is None:
+            trajectory_indices = np.arange(len(self.trajectories))
+        self.trajectory_indices = torch.as_tensor(
+            trajectory_indices, device=self.trajectories.device
+        )
+
+        steps = self.trajectories.shape[1]
+        # a trajectory shorter than a window is taken whole
+        window_length = min(input_length + output_length, steps)
+        self.windows_per_trajectory = steps - window_length + 1
+        self.window_offsets = torch.arange(
+            window_length, device=self.trajectories.device
+        )
+
+        self.output_length = output_length
+        self.input_length = window_length - output_length
 
     def __len__(self) -> int:
-        return len(self.data)
+        return len(self.trajectory_indices) * self.windows_per_trajectory
+
+    @property
+    def device(self) -> torch.device:
+        return self.trajectories.device
+
+    def share_memory_(self) -> "Dataset":
+        """
+        Moves the trajectories to shared memory once, so that spawned DataLoader workers map them instead of
+        receiving their own copy.
+        """
+        if not self.trajectories.is_shared():
+            self.trajectories = self.trajectories.clone().share_memory_()
+            self.trajectory_indices = self.trajectory_indices.clone().share_memory_()
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        return self.trajectories.element_size() * self.trajectories.nelement()
+
+    @property
+    def materialized_nbytes(self) -> int:
+        # memory that all windows would take as one array
+        window_size = len(self.window_offsets) * self.trajectories.shape[2]
+        return len(self) * window_size * self.trajectories.element_size()
+
+    def print_info(self, name: str) -> None:
+        print(
+            f"{len(self)} {name} pairs of shape ({self.input_length}, {self.output_length}) "
+            f"from {len(self.trajectory_indices)} trajectories, "
+            f"{self.nbytes / 1024**2:.1f} MB ({self.materialized_nbytes / 1024**2:.1f} MB if materialized)."
+        )
 
-    def __getitem__(self, idx: int) -> Tuple[torch.Tensor]:
-        x, y = self.data[idx]
-        x = torch.tensor(x)
-        y = torch.tensor(y)
-        return x, y
+    def __getitem__(self, idx: int | torch.Tensor) -> Tuple[torch.Tensor]:
+        # idx can also be a tensor of indices, then a whole batch is returned
+        idx = torch.as_tensor(idx, device=self.trajectories.device)
+        trajectory = self.trajectory_indices[idx // self.windows_per_trajectory]
+        offset = idx % self.windows_per_trajectory
+
+        # sequence.shape = [*idx.shape, input_length + output_length, 2]
+        sequence = self.trajectories[
+            trajectory[..., None], offset[..., None] + self.window_offsets
+        ]
+        return (
+            sequence[..., : self.input_length, :],
+            sequence[..., self.input_length :, :],
+        )
+
+    def __getitems__(self, indices: List[int]) -> Tuple[torch.Tensor]:
+        # batch[i].shape = [len(indices), input_length or output_length, 2]
+        return self[torch.as_tensor(indices)]
+
+
+class StreamingDataset(torch.utils.data.IterableDataset):
+    """
+    Endless stream of batches of windows over trajectories that map_object keeps generating from new initial points.
+
+    Note: A background thread generates chunks of map_object.init_points trajectories ahead of training and at most
+    prefetch chunks wait in a queue, so memory stays bounded. One epoch is batches_per_epoch batches (by default the
+    batches in one chunk) and the stream continues where the previous epoch stopped.
+    Note: With DataLoader workers or in distributed runs every worker and rank generates its own stream, seeded by
+    map_object.seed, the rank and the worker seed of the DataLoader, which torch draws anew for every epoch.
+    """
+
+    def __init__(
+        self,
+        map_object: StandardMap,
+        input_length: int,
+        output_length: int,
+        batch_size: int,
+        dtype: np.dtype = np.float32,
+        every_n_step: int = 1,
+        shuffle: bool = True,
+        batches_per_epoch: Optional[int] = None,
+        prefetch: int = 2,
+    ) -> None:
+        if map_object.sampling != "random":
+            warnings.warn(
+                f"Sampling is {map_object.sampling}, every chunk is generated from the same initial points."
+            )
+        map_object.progress_bar = False
+
+        self.map_object = map_object
+        self.input_length = input_length
+        self.output_length = output_length
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.every_n_step = every_n_step
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+
+        # same number of windows as Dataset gets from one chunk of trajectories
+        steps = -(-map_object.steps // every_n_step)
+        window_length = min(input_length + output_length, steps)
+        windows_per_chunk = len(map_object._get_K_list()) * (
+            map_object.init_points * (steps - window_length + 1)
+        )
+        self.batches_per_chunk = windows_per_chunk // batch_size
+        if self.batches_per_chunk == 0:
+            raise ValueError(
+                f"Batch size ({batch_size}) is larger than the number of windows in one chunk ({windows_per_chunk})."
+            )
+        self.batches_per_epoch: int = batches_per_epoch or self.batches_per_chunk
+
+        # created lazily in every process that iterates over the stream
+        self._queue: Optional[queue.Queue] = None
+        self._batches: Iterator[Tuple[torch.Tensor]] = iter(())
+
+    def __getstate__(self) -> dict:
+        # the producer thread and its queue stay in the process that started them
+        state = self.__dict__.copy()
+        state["_queue"] = None
+        state["_batches"] = iter(())
+        return state
+
+    def __len__(self) -> int:
+        return self.batches_per_epoch
+
+    @property
+    def device(self) -> torch.device:
+        return getattr(self.map_object, "device", torch.device("cpu"))
+
+    def print_info(self, name: str) -> None:
+        print(
+            f"Streaming {self.batches_per_epoch} {name} batches of {self.batch_size} pairs of shape "
+            f"({self.input_length}, {self.output_length}) per epoch, "
+            f"{self.map_object.init_points} new trajectories per chunk, {self.prefetch} chunks prefetched."
+        )
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor]]:
+        worker_info = torch.utils.data.get_worker_info()
+        num_batches = self.batches_per_epoch
+        if worker_info is not None:
+            # every worker yields its share of the epoch
+            num_batches = len(
+                range(worker_info.id, self.batches_per_epoch, worker_info.num_workers)
+            )
+
+        if self._queue is None:
+            self._start_producer(worker_info)
+
+        for _ in range(num_batches):
+            batch = next(self._batches, None)
+            if batch is None:
+                self._batches = self._chunk_batches(self._queue.get())
+                batch = next(self._batches)
+            yield batch
+
+    def _start_producer(self, worker_info: Optional[Any]) -> None:
+        # NOTE: rank_zero_only.rank is set by the strategy (or from the environment in spawned workers)
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank = torch.distributed.get_rank()
+        else:
+            rank = rank_zero_only.rank
+
+        if worker_info is not None or rank > 0:
+            # DDP ranks share map_object.seed and (through seed_everything) the worker seeds, so the rank is mixed
+            # in. worker_info.seed is drawn anew for every DataLoader iterator, so workers recreated every epoch
+            # (persistent_workers=False) do not replay the previous epoch.
+            seed = self.map_object.seed
+            entropy = [
+                np.random.SeedSequence().entropy if seed is None else seed,
+                rank,
+                0 if worker_info is None else worker_info.seed,
+            ]
+            self.map_object.rng = np.random.default_rng(np.random.SeedSequence(entropy))
+
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        threading.Thread(target=self._produce, args=(self._queue,), daemon=True).start()
+
+    def _produce(self, chunks: queue.Queue) -> None:
+        while True:
+            self.map_object.generate_data()
+            trajectories = self.map_object.retrieve_trajectories()
+            # blocks while prefetch chunks are waiting
+            chunks.put(
+                Dataset(
+                    trajectories[:, :: self.every_n_step],
+                    self.input_length,
+                    self.output_length,
+                    self.dtype,
+                )
+            )
+
+    def _chunk_batches(self, dataset: Dataset) -> Iterator[Tuple[torch.Tensor]]:
+        if self.shuffle:
+            indices = torch.randperm(len(dataset))
+        else:
+            indices = torch.arange(len(dataset))
+
+        for batch_indices in indices[: self.batches_per_chunk * self.batch_size].split(
+            self.batch_size
+        ):
+            yield dataset[batch_indices]
+
+
+class BatchIndexSampler(torch.utils.data.Sampler):
+    """
+    Yields whole batches of indices as tensors, so that a Dataset can return a batch with a single indexing operation.
+
+    Note: Use with DataLoader(batch_size=None), which disables automatic batching.
+    Note: In distributed runs each process takes every world_size-th batch, so Trainer(use_distributed_sampler=False) is required.
+    """
+
+    def __init__(
+        self,
+        num_samples: int,
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+    ) -> None:
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    @staticmethod
+    def _world() -> Tuple[int, int]:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _num_batches(self) -> int:
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return -(-self.num_samples // self.batch_size)
+
+    def __len__(self) -> int:
+        # every rank gets the same number of batches, as with DistributedSampler
+        _, world_size = self._world()
+        if self.drop_last:
+            return self._num_batches() // world_size
+        return -(-self._num_batches() // world_size)
+
+    def __iter__(self) -> Iterator[torch.Tensor]:
+        if self.shuffle:
+            # same seeding as torch.utils.data.RandomSampler
+            generator = torch.Generator()
+            generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_()))
+            indices = torch.randperm(self.num_samples, generator=generator)
+        else:
+            indices = torch.arange(self.num_samples)
+
+        batches = list(
+            indices[: self._num_batches() * self.batch_size].split(self.batch_size)
+        )
+
+        rank, world_size = self._world()
+        if world_size > 1:
+            # uneven shares would hang the collectives, so batches are dropped (drop_last)
+            # or repeated from the start until every rank has len(self) of them
+            total = len(self) * world_size
+            if total > len(batches):
+                batches += (batches * -(-total // max(len(batches), 1)))[
+                    : total - len(batches)
+                ]
+            batches = batches[:total][rank::world_size]
+
+        yield from batches
 
 
 class InferenceDataset(torch.utils.data.Dataset):
-    def __init__(self, data: List[Tuple[np.ndarray]], spectrum: np.ndarray):
-        self.data = data
+    def __init__(
+        self,
+        data: torch.Tensor,
+        spectrum: np.ndarray,
+        dtype: np.dtype = np.float32,
+    ):
+        # no copy if data already has the requested dtype
+        self.data = data.to(_to_torch_dtype(dtype))
         self.spectrum = spectrum
 
     def __len__(self) -> int:
         return len(self.data)
 
+    @property
+    def device(self) -> torch.device:
+        return self.data.device
+
+    def share_memory_(self) -> "InferenceDataset":
+        self.data.share_memory_()
+        return self
+
     def __getitem__(self, idx: int) -> Tuple[torch.Tensor]:
         x, y = self.data[idx], self.spectrum[idx]
         # x = torch.tensor(x)
@@ -0,0 +1,117 @@
+import torch
+import numpy as np
+from typing import Optional
+import contextlib
+import os
+
+try:
+    from src.utils import read_yaml
+except ModuleNotFoundError:
+    from utils import read_yaml
+
+
+def get_model_class(rnn_type: str) -> type:
+    if rnn_type == "vanillarnn":
+        from src.VanillaRNN import Vanilla as Model
+    elif rnn_type == "mgu":
+        from src.MGU import MGU as Model
+    elif rnn_type == "resrnn":
+        from src.ResRNN import ResRNN as Model
+    else:
+        raise ValueError(f"Invalid rnn_type: {rnn_type}")
+
+    return Model
+
+
+class InferenceRuntime:
+    """
+    Runs autoregressive rollouts of a trained model without pl.Trainer, Data and DataLoaders.
+
+    Note: The checkpoint is loaded once in __init__, every predict call only rolls out under torch.inference_mode
+    (with autocast if the model was trained with mixed precision), so it can be called in a loop.
+    """
+
+    def __init__(
+        self,
+        log_path: str,
+        params_update: Optional[dict] = None,
+        compile: bool = False,
+        device: str | torch.device = "cpu",
+    ) -> None:
+        params_update = params_update or {}
+        self.params: dict = read_yaml(os.path.join(log_path, "hparams.yaml"))
+        self.params.update(params_update)
+        self.device = torch.device(device)
+        self.every_n_step: int = self.params.get("every_n_step") or 1
+
+        Model = get_model_class(self.params.get("rnn_type"))
+        self.model = Model.load_from_checkpoint(
+            os.path.join(log_path, "model.ckpt"),
+            map_location=self.device,
+            **params_update,
+        )
+        self.model.eval()
+
+        if compile:
+            self.model.configure_compile()
+
+    def _autocast(self) -> contextlib.AbstractContextManager:
+        # same precision as in pl.Trainer(precision=...)
+        precision = str(self.params.get("precision"))
+        if precision == "bf16-mixed":
+            return torch.autocast(self.device.type, dtype=torch.bfloat16)
+        elif precision == "16-mixed":
+            return torch.autocast(self.device.type, dtype=torch.float16)
+        return contextlib.nullcontext()
+
+    def predict(
+        self,
+        trajectories: np.ndarray | torch.Tensor,
+        seq_length: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ) -> dict[str, torch.Tensor]:
+        """
+        Rolls out every trajectory from its first seq_length points (by default the model's seq_length) and compares
+        the predictions to the rest of it.
+
+        trajectories.shape = [num_paths, steps, 2], as returned by StandardMap.retrieve_trajectories. Returns the
+        same dict as BaseRNN.predictions (without the spectrum).
+
+        Note: Trajectories are rolled out batch_size at a time (all at once if None), loss and accuracy are
+        aggregated over batches weighted by the number of paths.
+        """
+        seq_length = seq_length or self.params.get("seq_length")
+        data = torch.as_tensor(trajectories)[:, :: self.every_n_step]
+        batch_size = batch_size or max(len(data), 1)
+
+        targets = data[:, seq_length:].to(self.model.dtype)
+        predicted = torch.empty_like(targets)
+        loss_sum = 0.0
+        accuracy_sum = 0.0
+
+        with torch.inference_mode(), self._autocast():
+            for start in range(0, len(data), batch_size):
+                batch = data[start : start + batch_size].to(
+                    self.device, self.model.dtype
+                )
+                batch_targets = batch[:, seq_length:]
+
+                batch_predicted = self.model.rollout(
+                    batch[:, :seq_length], batch_targets.shape[1]
+                )
+
+                loss_sum += (
+                    self.model.loss(batch_predicted, batch_targets).item() * len(batch)
+                )
+                accuracy_sum += (
+                    self.model.accuracy(batch_predicted, batch_targets).item()
+                    * len(batch)
+                )
+                predicted[start : start + len(batch)] = batch_predicted.cpu()
+
+        return {
+            "predicted": predicted,
+            "targets": targets,
+            "loss": torch.tensor(loss_sum / len(data)),
+            "accuracy": torch.tensor(accuracy_sum / len(data)),
+        }
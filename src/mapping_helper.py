@@ -1,7 +1,18 @@
 import numpy as np
+import torch
 import matplotlib.pyplot as plt
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 import pyprind
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import tempfile
+import warnings
+import os
+
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
 
 
 class StandardMap:
@@ -19,7 +30,14 @@ class StandardMap:
         horizontal_band_points: int = 0,
         seed: bool = None,
         params: dict = None,
+        memmap_dir: Optional[str] = None,
+        chunk_memory_mb: Optional[float] = None,
+        dtype: Optional[str] = None,
+        generation_workers: Optional[int] = None,
+        backend: Optional[str] = None,
+        progress_bar: bool = True,
     ) -> None:
+        params = params or {}
         self.init_points: int = init_points or params.get("init_points")
         self.steps: int = steps or params.get("steps")
         self.K: float | List[float] = K or params.get("K")
@@ -27,52 +45,217 @@ class StandardMap:
         self.vertical_band_points: int = vertical_band_points
         self.horizontal_band_points: int = horizontal_band_points
 
+        # NOTE: if set, trajectories are streamed to a .npy memmap in this directory
+        self.memmap_dir: Optional[str] = memmap_dir or params.get("memmap_dir")
+        # NOTE: memory for intermediate arrays while iterating, chunks of steps and points are sized to fit it
+        self.chunk_memory: int = int(
+            (chunk_memory_mb or params.get("chunk_memory_mb") or 256) * 1024**2
+        )
+
+        # NOTE: if > 1, trajectories are generated in a process pool
+        self.generation_workers: int = (
+            generation_workers or params.get("generation_workers") or 1
+        )
+
+        # NOTE: the map is always iterated in float64, dtype only sets how trajectories are stored
+        # (float64 unless requested, e.g. by the dtype in config/default.yaml for training data)
+        self.dtype: np.dtype = np.dtype(dtype or params.get("dtype") or "float64")
+
+        # "numpy" or "numba", the compiled kernel iterates each point in registers without temporary arrays
+        self.backend: str = backend or params.get("backend") or "numpy"
+        if self.backend == "numba" and numba is None:
+            warnings.warn("numba is not installed, falling back to the numpy backend.")
+            self.backend = "numpy"
+        elif self.backend not in ["numpy", "numba"]:
+            raise ValueError(f"Invalid backend: {self.backend}")
+
+        self.progress_bar: bool = progress_bar
+
+        self.seed: int = seed
         self.rng: np.random.Generator = np.random.default_rng(seed=seed)
         self.spectrum: np.ndarray = np.array([])
 
+    @property
+    def theta_values(self) -> np.ndarray:
+        # theta_values.shape = [steps, init_points * len(K)]
+        return self.trajectories[:, :, 0].T
+
+    @property
+    def p_values(self) -> np.ndarray:
+        # p_values.shape = [steps, init_points * len(K)]
+        return self.trajectories[:, :, 1].T
+
     def retrieve_data(self) -> Tuple[np.ndarray]:
         return self.theta_values, self.p_values
 
+    def get_params(self) -> dict:
+        """
+        Returns all parameters that determine the generated trajectories.
+        """
+        return {
+            "init_points": self.init_points,
+            "steps": self.steps,
+            "K": self.K,
+            "sampling": self.sampling,
+            "vertical_band_points": self.vertical_band_points,
+            "horizontal_band_points": self.horizontal_band_points,
+            "seed": self.seed,
+            "dtype": self.dtype.name,
+        }
+
+    def retrieve_trajectories(self) -> np.ndarray:
+        # trajectories.shape = [init_points * len(K), steps, 2]
+        return self.trajectories
+
     def generate_data(self) -> None:
         theta_i: np.ndarray
         p_i: np.ndarray
         theta_i, p_i = self._get_initial_points()
 
-        if not isinstance(self.K, list):
-            K_list: List[float] = [self.K]
+        K_list: np.ndarray = self._get_K_list()
+
+        if self.generation_workers > 1:
+            self._generate_data_parallel(theta_i, p_i, K_list)
         else:
-            if len(self.K) == 3 and isinstance(self.K[2], int):
-                K_list: List[float] = np.linspace(*self.K)
-            else:
-                K_list: List[float] = self.K
+            self.trajectories: np.ndarray = self._allocate_trajectories(
+                theta_i.shape[0] * len(K_list), self.memmap_dir
+            )
+
+            # theta.shape = p.shape = [len(K_list), init_points]
+            theta = np.tile(theta_i, (len(K_list), 1))
+            p = np.tile(p_i, (len(K_list), 1))
+            kick = K_list[:, np.newaxis] / (2 * np.pi)
+
+            pbar = None
+            if self.progress_bar:
+                # the numpy backend makes one pass over the steps per block of points
+                blocks = 1
+                if self.backend == "numpy":
+                    block_points, _ = _chunk_layout(
+                        theta.size, self.steps, self.chunk_memory
+                    )
+                    blocks = -(-theta.size // block_points)
+                pbar = pyprind.ProgBar(
+                    self.steps * blocks,
+                    bar_char="█",
+                    title="Generating data for Standard Map",
+                )
+
+            _iterate_map(
+                theta, p, kick, self.trajectories, self.chunk_memory, self.backend, pbar
+            )
+
+        if self.memmap_dir is not None:
+            # reopen read-only, pages are then loaded from disk only when accessed
+            self.trajectories.flush()
+            path = self.trajectories.filename
+            self.trajectories = np.load(path, mmap_mode="r")
+            # the mapping stays valid after the file is removed, so no file is left behind
+            # by repeated calls (every trial, or every chunk in online training)
+            os.remove(path)
+        if self.progress_bar:
+            print()
 
-        self.theta_values: np.ndarray = np.zeros(
-            (self.steps, theta_i.shape[0] * len(K_list))
+    def _generate_data_parallel(
+        self, theta_i: np.ndarray, p_i: np.ndarray, K_list: np.ndarray
+    ) -> None:
+        """
+        Generates trajectories in a process pool, sharded by K value and initial point chunk.
+
+        Note: Workers write directly into a memmap (in memmap_dir or in shared memory under /dev/shm), so no results
+        are pickled back. Every point is iterated exactly as in the serial path, so the output is identical.
+        """
+        init_points = theta_i.shape[0]
+
+        if self.memmap_dir is not None:
+            directory = self.memmap_dir
+        elif os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+        else:
+            directory = None
+
+        self.trajectories = self._allocate_trajectories(
+            init_points * len(K_list), directory
         )
-        self.p_values: np.ndarray = np.zeros((self.steps, p_i.shape[0] * len(K_list)))
+        path = self.trajectories.filename
 
-        self.theta_values[0] = np.tile(theta_i, len(K_list))
-        self.p_values[0] = np.tile(p_i, len(K_list))
+        # ~4 shards per worker, so that workers finishing early can pick up more work
+        shard_size = max(
+            1,
+            -(-init_points * len(K_list) // (4 * self.generation_workers)),
+        )
+        shard_size = min(shard_size, init_points)
+        shards = [
+            (i, start, min(start + shard_size, init_points))
+            for i in range(len(K_list))
+            for start in range(0, init_points, shard_size)
+        ]
 
-        pbar = pyprind.ProgBar(
-            len(K_list) * self.steps,
-            bar_char="█",
-            title="Generating data for Standard Map",
+        pbar = None
+        if self.progress_bar:
+            pbar = pyprind.ProgBar(
+                len(shards),
+                bar_char="█",
+                title="Generating data for Standard Map",
+            )
+
+        try:
+            # spawned, not forked: generate_data can run in a thread (StreamingDataset), and forking a
+            # multi-threaded process that holds torch locks can deadlock
+            with ProcessPoolExecutor(
+                max_workers=self.generation_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _generate_shard,
+                        path,
+                        theta_i[start:end],
+                        p_i[start:end],
+                        K_list[i],
+                        i * init_points + start,
+                        self.chunk_memory,
+                        self.backend,
+                    )
+                    for i, start, end in shards
+                ]
+                for future in as_completed(futures):
+                    future.result()
+                    if pbar is not None:
+                        pbar.update()
+        finally:
+            if self.memmap_dir is None:
+                # the mapping stays valid after the file is removed
+                os.remove(path)
+            # otherwise generate_data removes it after reopening it read-only
+
+    def _allocate_trajectories(
+        self, num_points: int, directory: Optional[str]
+    ) -> np.ndarray:
+        shape = (num_points, self.steps, 2)
+
+        if directory is None and self.generation_workers == 1:
+            return np.empty(shape, dtype=self.dtype)
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        file_descriptor, path = tempfile.mkstemp(
+            prefix="trajectories_", suffix=".npy", dir=directory
         )
+        os.close(file_descriptor)
+
+        return np.lib.format.open_memmap(path, mode="w+", dtype=self.dtype, shape=shape)
 
-        for i, K in enumerate(K_list):
-            theta = theta_i.copy()
-            p = p_i.copy()
-            for step in range(1, self.steps):
-                theta = np.mod(theta + p, 1)
-                p = np.mod(p + K / (2 * np.pi) * np.sin(2 * np.pi * theta), 1)
-                self.theta_values[
-                    step, i * theta_i.shape[0] : (i + 1) * theta_i.shape[0]
-                ] = theta
-                self.p_values[step, i * p_i.shape[0] : (i + 1) * p_i.shape[0]] = p
+    def _get_K_list(self) -> np.ndarray:
+        if not isinstance(self.K, list):
+            K_list: List[float] = [self.K]
+        else:
+            if len(self.K) == 3 and isinstance(self.K[2], int):
+                K_list: List[float] = np.linspace(*self.K)
+            else:
+                K_list: List[float] = self.K
 
-                pbar.update()
-        print()
+        return np.asarray(K_list, dtype=np.float64)
 
     def _get_initial_points(self) -> Tuple[np.ndarray, np.ndarray]:
         params: List = [0.0, 1.0, self.init_points]
@@ -168,6 +351,198 @@ class StandardMap:
         plt.show()
 
 
+class TorchStandardMap(StandardMap):
+    """
+    StandardMap that iterates the map in torch on the given device and returns the trajectories as a tensor.
+
+    Note: The tensor can be passed to Data directly, so no host-side copies are made. Ops run in torch's
+    intra-op thread pool, which is shared with the model.
+    """
+
+    def __init__(
+        self,
+        init_points: int = None,
+        steps: int = None,
+        K: float = None,
+        sampling: str = None,
+        vertical_band_points: int = 0,
+        horizontal_band_points: int = 0,
+        seed: bool = None,
+        params: dict = None,
+        dtype: Optional[str] = None,
+        device: str | torch.device = "cpu",
+    ) -> None:
+        super(TorchStandardMap, self).__init__(
+            init_points=init_points,
+            steps=steps,
+            K=K,
+            sampling=sampling,
+            vertical_band_points=vertical_band_points,
+            horizontal_band_points=horizontal_band_points,
+            seed=seed,
+            params=params,
+            dtype=dtype,
+        )
+        self.device: torch.device = torch.device(device)
+        self.torch_dtype: torch.dtype = torch.from_numpy(
+            np.empty(0, dtype=self.dtype)
+        ).dtype
+
+    def retrieve_trajectories(self) -> torch.Tensor:
+        # trajectories.shape = [init_points * len(K), steps, 2]
+        return self.trajectories
+
+    def generate_data(self) -> None:
+        theta_i: np.ndarray
+        p_i: np.ndarray
+        # initial points are drawn with self.rng, so they are the same as in StandardMap
+        theta_i, p_i = self._get_initial_points()
+
+        K_list: np.ndarray = self._get_K_list()
+
+        # theta.shape = p.shape = [len(K_list) * init_points], points for K_list[i] are in block i
+        theta = torch.from_numpy(np.tile(theta_i, len(K_list))).to(self.device)
+        p = torch.from_numpy(np.tile(p_i, len(K_list))).to(self.device)
+        kick = (
+            torch.from_numpy(K_list / (2 * np.pi))
+            .to(self.device)
+            .repeat_interleave(theta_i.shape[0])
+        )
+
+        # NOTE: the map is iterated in float64 as in StandardMap, dtype only sets how trajectories are stored
+        self.trajectories: torch.Tensor = torch.empty(
+            (theta.shape[0], self.steps, 2), dtype=self.torch_dtype, device=self.device
+        )
+        self.trajectories[:, 0, 0] = theta
+        self.trajectories[:, 0, 1] = p
+
+        for step in range(1, self.steps):
+            theta = torch.remainder(theta + p, 1)
+            p = torch.remainder(p + kick * torch.sin(2 * np.pi * theta), 1)
+            self.trajectories[:, step, 0] = theta
+            self.trajectories[:, step, 1] = p
+
+
+def _chunk_layout(num_points: int, steps: int, chunk_memory: int) -> Tuple[int, int]:
+    """
+    Returns (block_points, chunk_steps), so that one chunk of float64 theta and p values
+    (chunk_steps * 2 * block_points * 8 bytes) fits into chunk_memory bytes.
+    """
+    # at least one step of a block has to fit
+    block_points = min(num_points, max(1, chunk_memory // (2 * 8)))
+    chunk_steps = min(steps, max(1, chunk_memory // (2 * 8 * block_points)))
+    return block_points, chunk_steps
+
+
+def _iterate_map(
+    theta: np.ndarray,
+    p: np.ndarray,
+    kick: np.ndarray,
+    trajectories: np.ndarray,
+    chunk_memory: int,
+    backend: str = "numpy",
+    pbar: Optional[pyprind.ProgBar] = None,
+) -> None:
+    """
+    Iterates the map from the initial points theta and p (shape = [len(K), points]) with kick = K / (2 * pi)
+    (shape = [len(K), 1]) and writes all steps to trajectories (shape = [len(K) * points, steps, 2]).
+    """
+    steps = trajectories.shape[1]
+
+    # row i of trajectories holds point i % points for K_list[i // points]
+    theta = theta.ravel()
+    p = p.ravel()
+    kick = np.broadcast_to(kick, (kick.shape[0], theta.size // kick.shape[0])).ravel()
+
+    if backend == "numba":
+        _iterate_map_numba(theta, p, kick, np.asarray(trajectories))
+        if pbar is not None:
+            pbar.update(steps)
+        return
+
+    # points are split into blocks and steps into chunks, so only chunk.shape = [chunk_steps, 2, block_points]
+    # (at most chunk_memory bytes) and the current values of one block are kept in memory besides the output array
+    block_points, chunk_steps = _chunk_layout(theta.size, steps, chunk_memory)
+    chunk = np.empty((chunk_steps, 2, block_points))
+
+    for block_start in range(0, theta.size, block_points):
+        block_end = min(block_start + block_points, theta.size)
+        theta_block = theta[block_start:block_end]
+        p_block = p[block_start:block_end]
+        kick_block = kick[block_start:block_end]
+        block_chunk = chunk[:, :, : block_end - block_start]
+
+        for chunk_start in range(0, steps, chunk_steps):
+            current_steps = min(chunk_steps, steps - chunk_start)
+
+            # every (K, initial point) pair in the block is moved forward at once
+            for step in range(current_steps):
+                if chunk_start + step > 0:
+                    theta_block = np.mod(theta_block + p_block, 1)
+                    p_block = np.mod(
+                        p_block + kick_block * np.sin(2 * np.pi * theta_block), 1
+                    )
+                if pbar is not None:
+                    pbar.update()
+                block_chunk[step, 0] = theta_block
+                block_chunk[step, 1] = p_block
+
+            trajectories[
+                block_start:block_end, chunk_start : chunk_start + current_steps
+            ] = block_chunk[:current_steps].transpose(2, 0, 1)
+
+
+def _generate_shard(
+    path: str,
+    theta: np.ndarray,
+    p: np.ndarray,
+    K: float,
+    first_row: int,
+    chunk_memory: int,
+    backend: str,
+) -> None:
+    """
+    Runs in a worker process and writes the trajectories of one K value and one chunk of initial points
+    into rows [first_row, first_row + len(theta)) of the memmap at path.
+    """
+    trajectories = np.load(path, mmap_mode="r+")
+    kick = np.array([[K]]) / (2 * np.pi)
+
+    _iterate_map(
+        theta[np.newaxis],
+        p[np.newaxis],
+        kick,
+        trajectories[first_row : first_row + theta.shape[0]],
+        chunk_memory,
+        backend,
+    )
+    trajectories.flush()
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _iterate_map_numba(
+        theta: np.ndarray, p: np.ndarray, kick: np.ndarray, trajectories: np.ndarray
+    ) -> None:
+        """
+        theta.shape = p.shape = kick.shape = [points], trajectories.shape = [points, steps, 2]
+
+        Note: Each point is iterated over all steps in registers, without temporary arrays.
+        """
+        for point in numba.prange(theta.shape[0]):
+            theta_t = theta[point]
+            p_t = p[point]
+            trajectories[point, 0, 0] = theta_t
+            trajectories[point, 0, 1] = p_t
+
+            for step in range(1, trajectories.shape[1]):
+                theta_t = np.mod(theta_t + p_t, 1)
+                p_t = np.mod(p_t + kick[point] * np.sin(2 * np.pi * theta_t), 1)
+                trajectories[point, step, 0] = theta_t
+                trajectories[point, step, 1] = p_t
+
+
 if __name__ == "__main__":
     map = StandardMap(
         init_points=120 * 120,
@@ -0,0 +1,125 @@
+import pytorch_lightning as pl
+from pytorch_lightning.callbacks import Callback
+
+from typing import List, Optional
+import warnings
+import math
+import os
+
+try:
+    from src.utils import read_yaml, save_yaml
+except ModuleNotFoundError:
+    from utils import read_yaml, save_yaml
+
+
+class SuccessiveHalvingPruner(Callback):
+    """
+    Stops trials whose validation loss is not among the best 1/eta of all trials that reached the same rung
+    (asynchronous successive halving).
+
+    Rung r is reached after min_epochs * eta**r epochs. Every trial writes its loss at a rung to
+    <experiment>/pruning/rung_<r>/version_<v>.yaml, so trials running at once in other processes (and earlier
+    trials) are compared through the filesystem.
+
+    Note: A pruned trial writes pruned.yaml into its version directory, so that update.py counts it as a bad sample.
+    Note: Trials are never pruned at a rung that fewer than eta trials have reached.
+    """
+
+    def __init__(
+        self, monitor: str = "loss/val", min_epochs: int = 100, eta: int = 3
+    ) -> None:
+        super().__init__()
+        self.monitor = monitor
+        self.min_epochs = min_epochs
+        self.eta = eta
+        self.rung = 0
+
+    def rung_epochs(self, rung: int) -> int:
+        return self.min_epochs * self.eta**rung
+
+    def on_validation_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule
+    ) -> None:
+        if trainer.sanity_checking:
+            return
+        # a metric that is never logged is an error (as in EarlyStopping), not a trial that never prunes
+        if self.monitor not in trainer.callback_metrics:
+            raise RuntimeError(
+                f"Pruning monitor '{self.monitor}' was not logged, available metrics: "
+                f"{', '.join(trainer.callback_metrics)}."
+            )
+
+        epoch = trainer.current_epoch + 1
+        if epoch < self.rung_epochs(self.rung):
+            return
+
+        prune = False
+        if trainer.is_global_zero:
+            loss = float(trainer.callback_metrics[self.monitor])
+            prune = self._report(trainer.logger.log_dir, epoch, loss)
+        prune = trainer.strategy.broadcast(prune)
+
+        if prune:
+            trainer.should_stop = True
+        # later rungs that were skipped over (with sparse validation) are not evaluated separately
+        while epoch >= self.rung_epochs(self.rung):
+            self.rung += 1
+
+    def on_train_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        # on_validation_end never runs if the validation dataloader is empty
+        if self.rung == 0 and trainer.current_epoch >= self.min_epochs:
+            warnings.warn(
+                f"Trained for {trainer.current_epoch} epochs without reaching the first "
+                f"pruning rung, was validation run (and '{self.monitor}' logged)?"
+            )
+
+    def _report(self, log_dir: str, epoch: int, loss: float) -> bool:
+        """
+        Records loss at the current rung and returns True if the trial should be pruned.
+        """
+        version = os.path.basename(os.path.normpath(log_dir))
+        rung_dir = os.path.join(
+            os.path.dirname(os.path.normpath(log_dir)), "pruning", f"rung_{self.rung}"
+        )
+        os.makedirs(rung_dir, exist_ok=True)
+
+        # written under a temporary name first, so that other trials never read a partial file
+        path = os.path.join(rung_dir, f"{version}.yaml")
+        save_yaml({"epoch": epoch, "loss": loss}, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+        losses = get_rung_losses(rung_dir)
+        if len(losses) < self.eta:
+            return False
+
+        # keep the best 1/eta of all trials at this rung, but always at least one
+        keep = max(1, math.floor(len(losses) / self.eta))
+        rank = sum(other < loss for other in losses)
+        if rank < keep:
+            return False
+
+        save_yaml(
+            {
+                "epoch": epoch,
+                "rung": self.rung,
+                "loss": loss,
+                "rank": rank,
+                "trials_at_rung": len(losses),
+            },
+            os.path.join(log_dir, "pruned.yaml"),
+        )
+        return True
+
+
+def get_rung_losses(rung_dir: str) -> List[float]:
+    losses = []
+    for file in os.listdir(rung_dir):
+        if file.endswith(".yaml"):
+            result: Optional[dict] = read_yaml(os.path.join(rung_dir, file))
+            if result is not None and "loss" in result:
+                losses.append(result["loss"])
+    return losses
+
+
+def is_pruned(version_dir: str) -> bool:
+    return os.path.isfile(os.path.join(version_dir, "pruned.yaml"))
@@ -0,0 +1,105 @@
+import pandas as pd
+from typing import Dict, Set, List, Tuple, Callable, Any
+from contextlib import closing
+import pathlib
+import sqlite3
+import json
+import time
+import os
+
+
+class ResultsStore:
+    """
+    SQLite table of finished gridsearch trials in <experiment>/results.sqlite, one row per version with its
+    best_loss and hparams.
+
+    Note: Trials append their row when they finish, so the history is read with one query instead of parsing
+    every TensorBoard event file. The database uses a rollback journal (WAL needs shared memory, which network
+    filesystems of clusters don't provide) and operations that fail on a lock are retried.
+    Note: The file is only created by add, reading a missing store returns no trials.
+    """
+
+    def __init__(self, experiment_path: str, retries: int = 5) -> None:
+        self.path = os.path.join(experiment_path, "results.sqlite")
+        self.retries = retries
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        if read_only:
+            uri = f"{pathlib.Path(self.path).absolute().as_uri()}?mode=ro"
+            return sqlite3.connect(uri, uri=True, timeout=60)
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _run(
+        self, operation: Callable[[sqlite3.Connection], Any], read_only: bool = False
+    ) -> Any:
+        for attempt in range(self.retries):
+            try:
+                with closing(self._connect(read_only)) as connection:
+                    # commits on success, rolls back on an exception
+                    with connection:
+                        return operation(connection)
+            except sqlite3.OperationalError:
+                # locking on network filesystems can fail right away instead of waiting for the timeout
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2**attempt)
+
+    def add(
+        self, version: int, best_loss: float, hparams: Dict, pruned: bool = False
+    ) -> None:
+        def insert(connection: sqlite3.Connection) -> None:
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trials (
+                    version INTEGER PRIMARY KEY,
+                    best_loss REAL,
+                    pruned INTEGER NOT NULL,
+                    hparams TEXT NOT NULL,
+                    finished TEXT NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?)",
+                (
+                    version,
+                    best_loss,
+                    int(pruned),
+                    json.dumps(hparams, default=str),
+                    time.ctime(),
+                ),
+            )
+
+        self._run(insert)
+
+    def _select(self, query: str) -> List[Tuple]:
+        if not os.path.exists(self.path):
+            return []
+        return self._run(
+            lambda connection: connection.execute(query).fetchall(), read_only=True
+        )
+
+    def versions(self) -> Set[int]:
+        return {row[0] for row in self._select("SELECT version FROM trials")}
+
+    def load(self) -> pd.DataFrame:
+        """
+        Returns the same columns as update.get_loss_and_params: directory (the version), best_loss and all hparams.
+
+        Note: Pruned trials get an infinite best_loss, so they never count as good samples.
+        """
+        rows = self._select(
+            "SELECT version, best_loss, pruned, hparams FROM trials ORDER BY version"
+        )
+
+        return pd.DataFrame(
+            [
+                {
+                    "directory": version,
+                    "best_loss": float("inf") if pruned else best_loss,
+                    **json.loads(hparams),
+                }
+                for version, best_loss, pruned, hparams in rows
+            ]
+        )
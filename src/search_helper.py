@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+from typing import Any, List, Optional
+
+
+class RandomSearch:
+    """
+    Samples every hyperparameter uniformly at random from its interval or list.
+    """
+
+    def sample(self, params: dict, rng: np.random.Generator) -> dict:
+        for key, space in params.get("gridsearch").items():
+            params[key] = self.sample_value(space, rng)
+
+        return params
+
+    @staticmethod
+    def sample_value(space: dict, rng: np.random.Generator) -> Any:
+        type = space.get("type")
+        if type == "int":
+            return int(rng.integers(space["lower"], space["upper"] + 1))
+        elif type == "choice":
+            return _parse_choice(rng.choice(space.get("list")))
+        elif type == "float":
+            return rng.uniform(space["lower"], space["upper"])
+        elif type == "log":
+            log_value = rng.uniform(space["lower"], space["upper"])
+            return 10**log_value
+
+
+class TPESearch(RandomSearch):
+    """
+    Tree-structured Parzen estimator, fit on the history of finished trials (update.get_loss_and_params).
+
+    Trials are split into the best gamma fraction and the rest by best_loss. For every hyperparameter n_candidates
+    values are drawn from a Parzen estimator of the good trials and the one that maximizes l(x) / g(x), the ratio of
+    the good and bad densities, is taken.
+
+    Note: Hyperparameters are modelled independently. With fewer than n_startup finished trials values are sampled
+    at random.
+    """
+
+    def __init__(
+        self,
+        history: Optional[pd.DataFrame],
+        gamma: float = 0.25,
+        n_candidates: int = 24,
+        n_startup: int = 10,
+    ) -> None:
+        if history is None or "best_loss" not in history:
+            history = pd.DataFrame({"best_loss": []})
+        # pruned and diverged trials carry no information about where the good region is
+        self.history = history[np.isfinite(history["best_loss"])]
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.n_startup = n_startup
+
+    def sample(self, params: dict, rng: np.random.Generator) -> dict:
+        if len(self.history) < self.n_startup:
+            return super().sample(params, rng)
+
+        history = self.history.sort_values("best_loss")
+        n_good = max(1, int(np.ceil(self.gamma * len(history))))
+
+        for key, space in params.get("gridsearch").items():
+            if key not in history:
+                params[key] = self.sample_value(space, rng)
+                continue
+
+            values = history[key].dropna()
+            good = values[values.index.isin(history.index[:n_good])].to_list()
+            bad = values[values.index.isin(history.index[n_good:])].to_list()
+
+            if space.get("type") == "choice":
+                params[key] = self._sample_choice(space, good, bad, rng)
+            else:
+                params[key] = self._sample_numeric(space, good, bad, rng)
+
+        return params
+
+    def _sample_numeric(
+        self,
+        space: dict,
+        good: List[float],
+        bad: List[float],
+        rng: np.random.Generator,
+    ) -> float | int:
+        type = space.get("type")
+        lower, upper = float(space["lower"]), float(space["upper"])
+
+        # a fixed parameter has nothing to model, and zero bandwidths would give NaN scores
+        if upper <= lower:
+            value = lower
+        else:
+            # log parameters are modelled in the exponent, as they are sampled
+            if type == "log":
+                good = np.log10(good)
+                bad = np.log10(bad)
+            good = np.clip(np.asarray(good, dtype=float), lower, upper)
+            bad = np.clip(np.asarray(bad, dtype=float), lower, upper)
+
+            good_estimator = _ParzenEstimator(good, lower, upper)
+            bad_estimator = _ParzenEstimator(bad, lower, upper)
+
+            candidates = good_estimator.sample(self.n_candidates, rng)
+            scores = good_estimator.log_pdf(candidates)
+            scores -= bad_estimator.log_pdf(candidates)
+            value = candidates[np.argmax(scores)]
+
+        if type == "int":
+            return int(np.clip(np.round(value), lower, upper))
+        elif type == "log":
+            return 10**value
+        return float(value)
+
+    def _sample_choice(
+        self,
+        space: dict,
+        good: List[Any],
+        bad: List[Any],
+        rng: np.random.Generator,
+    ) -> Any:
+        choices = [_parse_choice(choice) for choice in space.get("list")]
+        good = [_parse_choice(value) for value in good]
+        bad = [_parse_choice(value) for value in bad]
+
+        # counts with a prior of one observation per choice
+        good_weights = np.array([1.0 + good.count(choice) for choice in choices])
+        bad_weights = np.array([1.0 + bad.count(choice) for choice in choices])
+        good_weights /= good_weights.sum()
+        bad_weights /= bad_weights.sum()
+
+        candidates = rng.choice(len(choices), size=self.n_candidates, p=good_weights)
+        scores = good_weights[candidates] / bad_weights[candidates]
+        return choices[candidates[np.argmax(scores)]]
+
+
+class _ParzenEstimator:
+    """
+    Mixture of one Gaussian per observation and a wide Gaussian prior over [lower, upper].
+
+    Note: The bandwidth of every Gaussian is the distance to its farther neighbour, as in hyperopt. Samples are
+    clipped to [lower, upper].
+    """
+
+    def __init__(self, observations: np.ndarray, lower: float, upper: float) -> None:
+        self.lower = lower
+        self.upper = upper
+        # the prior is one more component, centered in the interval and as wide as it
+        self.means = np.append(observations, (lower + upper) / 2)
+
+        order = np.argsort(self.means)
+        sorted_means = np.concatenate(([lower], self.means[order], [upper]))
+        sigmas = np.maximum(
+            sorted_means[1:-1] - sorted_means[:-2],
+            sorted_means[2:] - sorted_means[1:-1],
+        )
+        self.sigmas = np.empty_like(sigmas)
+        self.sigmas[order] = np.clip(
+            sigmas, (upper - lower) / min(100, len(self.means) + 1), upper - lower
+        )
+        self.sigmas[-1] = upper - lower
+
+    def sample(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        components = rng.integers(len(self.means), size=size)
+        samples = rng.normal(self.means[components], self.sigmas[components])
+        return np.clip(samples, self.lower, self.upper)
+
+    def log_pdf(self, x: np.ndarray) -> np.ndarray:
+        # densities.shape = [len(x), len(means)]
+        z = (x[:, np.newaxis] - self.means) / self.sigmas
+        densities = np.exp(-0.5 * z**2) / (np.sqrt(2 * np.pi) * self.sigmas)
+        return np.log(densities.mean(axis=1) + 1e-300)
+
+
+def _parse_choice(choice: Any) -> float | str:
+    try:
+        return float(choice)
+    except (TypeError, ValueError):
+        return str(choice)
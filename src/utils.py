@@ -1,14 +1,20 @@
-from typing import List
+from typing import List, Optional, Tuple
 import numpy as np
 import yaml
 from argparse import Namespace, ArgumentParser
 import os
-from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+import struct
+from tensorboard.compat.proto import event_pb2
+from tensorboard.util import tensor_util
 import torch
 import matplotlib.pyplot as plt
-import functools
 import logging
 
+try:
+    from src.search_helper import RandomSearch
+except ModuleNotFoundError:
+    from search_helper import RandomSearch
+
 
 def read_yaml(parameters_path: str) -> dict:
     with open(parameters_path, "r") as file:
@@ -71,23 +77,101 @@ class Parameter:
             self.count = 0
 
 
-def read_events_file(events_file_path: str) -> EventAccumulator:
-    event_acc = EventAccumulator(events_file_path)
-    event_acc.Reload()
-    return event_acc
-
+def read_last_scalar(
+    events_file_path: str,
+    tag: str,
+    offset: int = 0,
+    last_value: Optional[float] = None,
+) -> Tuple[Optional[float], int]:
+    """
+    Returns the last value of one scalar tag (last_value if the tag isn't in the file after offset) and the byte
+    offset after the last complete record.
+
+    Note: The file is parsed directly as TFRecords, each one a little-endian uint64 data length, a uint32 masked
+    CRC of the length, the serialized Event and a uint32 masked CRC of the data. CRCs are not checked, and an
+    incomplete last record (still being written) is left for the next call.
+    Note: Records are read one by one, so no other tags are kept in memory. Passing the returned value and offset
+    back reads only what was appended to a growing file since.
+    """
+    with open(events_file_path, "rb") as file:
+        file.seek(offset)
+        while True:
+            # TFRecord: data length (uint64), its crc (uint32), data, data crc (uint32)
+            header = file.read(12)
+            if len(header) < 12:
+                break
+            (length,) = struct.unpack("<Q", header[:8])
+            data = file.read(length + 4)
+            if len(data) < length + 4:
+                # the record is still being written
+                break
+            offset += 12 + length + 4
+
+            event = event_pb2.Event.FromString(data[:length])
+            for value in event.summary.value:
+                if value.tag != tag:
+                    continue
+                if value.HasField("simple_value"):
+                    last_value = value.simple_value
+                elif value.HasField("tensor"):
+                    last_value = tensor_util.make_ndarray(value.tensor).item()
+    return last_value, offset
+
+
+def extract_best_loss_from_event_file(
+    events_file_path: str, cache: Optional[dict] = None
+) -> Optional[dict]:
+    """
+    Returns {"best_loss": value} with the last best_loss in the file, or None if it wasn't logged.
+
+    Note: If a cache dict is given, results are stored in it keyed by path and reused while the file's
+    (mtime, size) stays the same. A file that grew is read from the offset where the previous read stopped.
+    """
+    stat = os.stat(events_file_path)
+    signature = [stat.st_mtime_ns, stat.st_size]
+    offset, best_loss = 0, None
+    if cache is not None:
+        cached = cache.get(events_file_path)
+        if cached is not None and cached["signature"] == signature:
+            return cached["result"]
+        # a file that shrank was replaced and is read again from the start
+        if (
+            cached is not None
+            and "offset" in cached
+            and cached["offset"] <= stat.st_size
+        ):
+            offset, best_loss = cached["offset"], cached["last_value"]
+
+    best_loss, offset = read_last_scalar(
+        events_file_path, "best_loss", offset=offset, last_value=best_loss
+    )
+    result = None if best_loss is None else {"best_loss": best_loss}
 
-def extract_best_loss_from_event_file(events_file_path: str) -> str | float | int:
-    event_values = read_events_file(events_file_path)
-    for tag in event_values.Tags()["scalars"]:
-        if tag == "best_loss":
-            return {"best_loss": event_values.Scalars(tag)[-1].value}
+    if cache is not None:
+        cache[events_file_path] = {
+            "signature": signature,
+            "offset": offset,
+            "last_value": best_loss,
+            "result": result,
+        }
+    return result
 
 
 class Gridsearch:
-    def __init__(self, params_path: str, use_defaults: bool = False) -> None:
+    """
+    Samples parameters for the next trial from the intervals in parameters.yaml with a search strategy
+    (RandomSearch by default, or TPESearch fit on earlier trials).
+    """
+
+    def __init__(
+        self,
+        params_path: str,
+        use_defaults: bool = False,
+        strategy: Optional[RandomSearch] = None,
+    ) -> None:
         self.path = params_path
         self.use_defaults = use_defaults
+        self.strategy = strategy or RandomSearch()
 
     def update_params(self) -> dict:
         params = read_yaml(self.path)
@@ -105,25 +189,7 @@ class Gridsearch:
         # don't use any seed
         rng: np.random.Generator = np.random.default_rng(None)
 
-        for key, space in params.get("gridsearch").items():
-            type = space.get("type")
-            if type == "int":
-                params[key] = int(rng.integers(space["lower"], space["upper"] + 1))
-            elif type == "choice":
-                list = space.get("list")
-                choice = rng.choice(list)
-                try:
-                    choice = float(choice)
-                except:
-                    choice = str(choice)
-                params[key] = choice
-            elif type == "float":
-                params[key] = rng.uniform(space["lower"], space["upper"])
-            elif type == "log":
-                log_value = rng.uniform(space["lower"], space["upper"])
-                params[key] = 10**log_value
-
-        return params
+        return self.strategy.sample(params, rng)
 
 
 def plot_2d(
@@ -276,26 +342,6 @@ def plot_spatial_errors(
         plt.close()
 
 
-def conditional_torch_compile(compile, *args, **kwargs):
-    def decorator(func):
-        if compile:
-            compiled_func = torch.compile(func, *args, **kwargs)
-
-            @functools.wraps(func)
-            def wrapped(*args, **kwargs):
-                return compiled_func(*args, **kwargs)
-
-        else:
-
-            @functools.wraps(func)
-            def wrapped(*args, **kwargs):
-                return func(*args, **kwargs)
-
-        return wrapped
-
-    return decorator
-
-
 def import_parsed_args(script_name: str) -> Namespace:
     parser = ArgumentParser(prog=script_name)
 
@@ -312,98 +358,193 @@ def import_parsed_args(script_name: str) -> Namespace:
             action="store_true",
             help="Use default parameters for the gridsearch. (default: False)",
         )
+        _add_strategy_args(parser)
 
     elif script_name == "Autoregressor trainer":
-        parser.add_argument(
-            "--epochs",
-            type=int,
-            help="Number of epochs to train the model for.",
-        )
-        parser.add_argument(
-            "--monitor_checkpoint",
-            type=str,
-            default="loss/train",
-            help="Monitor value for checkpointing. (default: loss/train)",
-        )
-        parser.add_argument(
-            "--mode_checkpoint",
-            type=str,
-            default="min",
-            help="Mode for checkpointing. (default: min)",
-        )
-        parser.add_argument(
-            "--monitor_stopping",
-            type=str,
-            default="loss/train",
-            help="Monitor value for stopping. (default: loss/train)",
-        )
-        parser.add_argument(
-            "--mode_stopping",
-            type=str,
-            default="min",
-            help="Mode for stopping. (default: min)",
-        )
-        parser.add_argument(
-            "--train_size",
-            type=float,
-            default=1.0,
-            help="Fraction of data to use for training. (default: 1.0)",
-        )
-        parser.add_argument(
-            "--progress_bar",
-            "-prog",
-            action="store_true",
-            help="Show progress bar during training. (default: False)",
-        )
-        parser.add_argument(
-            "--compile",
-            action="store_true",
-            help="Compile the model. (default: False)",
-        )
-        parser.add_argument(
-            "--devices",
-            nargs="*",
-            type=int,
-            help="List of devices to use.",
-        )
-        parser.add_argument(
-            "--num_nodes",
-            type=int,
-            default=1,
-            help="Specify number of nodes to use. (default: 1)",
-        )
-        parser.add_argument(
-            "--checkpoint_path",
-            "-ckpt",
-            type=str,
-            default=None,
-            help="Path to the checkpoint file. (default: None)",
-        )
+        _add_trainer_args(parser)
 
     elif script_name == "Parameter updater":
+        _add_updater_args(parser)
+
+    elif script_name == "Trial scheduler":
+        _add_trainer_args(parser)
+        _add_updater_args(parser)
+        _add_strategy_args(parser)
         parser.add_argument(
-            "--max_good_loss",
-            type=float,
-            default=1e-5,
-            help="Maximum loss value considered acceptable for selecting parameters. (default: 1e-5)",
-        )
-        parser.add_argument(
-            "--min_good_samples",
+            "--rounds",
             type=int,
-            default=4,
-            help="Minimum number of good samples required to start updating parameters. (default: 4)",
+            default=1,
+            help="Number of rounds of trials, parameter intervals are updated after every round. (default: 1)",
         )
         parser.add_argument(
-            "--check_every_n_steps",
+            "--trials",
             type=int,
-            default=3,
-            help="Check for new good samples every n steps. Its suggested that check_every_n_steps < min_good_samples, so that results are less likely to converge to a local optimium. (default: 3)",
+            default=4,
+            help="Number of trials trained at once in every round. (default: 4)",
         )
         parser.add_argument(
-            "--current_step",
+            "--cores_per_trial",
             type=int,
-            default=1,
-            help="Current step of the training. (default: 1)",
+            default=None,
+            help="CPU cores every trial is pinned to, available cores are split evenly if not set. (default: None)",
         )
 
     return parser.parse_args()
+
+
+def _add_trainer_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        help="Number of epochs to train the model for.",
+    )
+    parser.add_argument(
+        "--monitor_checkpoint",
+        type=str,
+        default="loss/train",
+        help="Monitor value for checkpointing. (default: loss/train)",
+    )
+    parser.add_argument(
+        "--mode_checkpoint",
+        type=str,
+        default="min",
+        help="Mode for checkpointing. (default: min)",
+    )
+    parser.add_argument(
+        "--monitor_stopping",
+        type=str,
+        default="loss/train",
+        help="Monitor value for stopping. (default: loss/train)",
+    )
+    parser.add_argument(
+        "--mode_stopping",
+        type=str,
+        default="min",
+        help="Mode for stopping. (default: min)",
+    )
+    parser.add_argument(
+        "--train_size",
+        type=float,
+        default=1.0,
+        help="Fraction of data to use for training. (default: 1.0)",
+    )
+    parser.add_argument(
+        "--progress_bar",
+        "-prog",
+        action="store_true",
+        help="Show progress bar during training. (default: False)",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Compile the model. (default: False)",
+    )
+    parser.add_argument(
+        "--devices",
+        nargs="*",
+        type=int,
+        help="List of devices to use.",
+    )
+    parser.add_argument(
+        "--num_nodes",
+        type=int,
+        default=1,
+        help="Specify number of nodes to use. (default: 1)",
+    )
+    parser.add_argument(
+        "--checkpoint_path",
+        "-ckpt",
+        type=str,
+        default=None,
+        help="Path to the checkpoint file. (default: None)",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory of the dataset cache, data is regenerated every run if not set. (default: None)",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=20.0,
+        help="Maximum size of the dataset cache in GB. (default: 20.0)",
+    )
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=None,
+        help="Stop training if monitor_stopping didn't improve for this many validation checks, never if not set. (default: None)",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Stop trials whose prune_monitor value is not among the best 1/prune_eta at successive halving rungs. (default: False)",
+    )
+    parser.add_argument(
+        "--prune_monitor",
+        type=str,
+        default="loss/val",
+        help="Monitor value for pruning. (default: loss/val)",
+    )
+    parser.add_argument(
+        "--prune_min_epochs",
+        type=int,
+        default=100,
+        help="Epochs before the first pruning rung, rung r is at prune_min_epochs * prune_eta**r. (default: 100)",
+    )
+    parser.add_argument(
+        "--prune_eta",
+        type=int,
+        default=3,
+        help="Reduction factor of successive halving. (default: 3)",
+    )
+    parser.add_argument(
+        "--version",
+        type=int,
+        default=None,
+        help="Version directory to log to, the next free version if not set. (default: None)",
+    )
+
+
+def _add_updater_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--max_good_loss",
+        type=float,
+        default=1e-5,
+        help="Maximum loss value considered acceptable for selecting parameters. (default: 1e-5)",
+    )
+    parser.add_argument(
+        "--min_good_samples",
+        type=int,
+        default=4,
+        help="Minimum number of good samples required to start updating parameters. (default: 4)",
+    )
+    parser.add_argument(
+        "--check_every_n_steps",
+        type=int,
+        default=3,
+        help="Check for new good samples every n steps. Its suggested that check_every_n_steps < min_good_samples, so that results are less likely to converge to a local optimium. (default: 3)",
+    )
+    parser.add_argument(
+        "--current_step",
+        type=int,
+        default=1,
+        help="Current step of the training. (default: 1)",
+    )
+
+
+def _add_strategy_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--strategy",
+        type=str,
+        default="random",
+        choices=["random", "tpe"],
+        help="Search strategy, tpe is fit on the results of earlier trials. (default: random)",
+    )
+    parser.add_argument(
+        "--n_startup",
+        type=int,
+        default=10,
+        help="Trials sampled at random before tpe is used. (default: 10)",
+    )
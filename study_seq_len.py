@@ -1,15 +1,13 @@
 import os
 import pytorch_lightning as pl
 from src.mapping_helper import StandardMap
-from src.helper import Model, Data
+from src.inference_helper import InferenceRuntime
 from src.utils import read_yaml, get_inference_folders, plot_losses
 from typing import Optional
 import warnings
 import numpy as np
 import pyprind
 
-from autoregressor import inference
-
 warnings.filterwarnings(
     "ignore",
     module="pytorch_lightning",
@@ -32,6 +30,11 @@ def main():
         params: dict = read_yaml(params_path)
 
         map = StandardMap(seed=42, params=params)
+        map.generate_data()
+        trajectories = map.retrieve_trajectories()
+
+        # the model is loaded once and reused for every seq_len
+        runtime = InferenceRuntime(log_path)
 
         seq_lens = np.arange(3, 50, 1)
         losses = []
@@ -39,7 +42,7 @@ def main():
         pbar = pyprind.ProgBar(iterations=len(seq_lens), bar_char="█", track_time=False)
 
         for seq_len in seq_lens:
-            predictions, datamodule = inference(log_path, params, map, seq_len=seq_len)
+            predictions = runtime.predict(trajectories, seq_length=int(seq_len))
 
             losses.append(predictions["loss"].item())
             pbar.update()
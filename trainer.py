@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, List, Dict
+from typing import TYPE_CHECKING, List, Dict, Optional
 
 if TYPE_CHECKING:
     from pytorch_lightning.callbacks import callbacks
@@ -14,6 +14,10 @@ from pytorch_lightning.callbacks import (
 
 from src.mapping_helper import StandardMap
 from src.data_helper import Data
+from src.cache_helper import DatasetCache
+from src.pruning_helper import SuccessiveHalvingPruner, is_pruned
+from src.results_helper import ResultsStore
+from src.inference_helper import get_model_class
 from src.utils import import_parsed_args, read_yaml, setup_logger
 
 from argparse import Namespace
@@ -32,7 +36,27 @@ seed_everything(42, workers=True)
 
 
 def get_callbacks(args: Namespace, save_path: str) -> List[callbacks]:
-    return [
+    extra_callbacks = []
+    if args.patience is not None:
+        extra_callbacks.append(
+            EarlyStopping(
+                monitor=args.monitor_stopping,
+                mode=args.mode_stopping,
+                min_delta=1e-8,
+                patience=args.patience,
+            )
+        )
+    if args.prune:
+        extra_callbacks.append(
+            SuccessiveHalvingPruner(
+                monitor=args.prune_monitor,
+                min_epochs=args.prune_min_epochs,
+                eta=args.prune_eta,
+            )
+        )
+
+    # NOTE: ModelCheckpoint stays last, BaseRNN.on_train_epoch_end reads its best score
+    return extra_callbacks + [
         ModelCheckpoint(
             monitor=args.monitor_checkpoint,
             mode=args.mode_checkpoint,
@@ -41,12 +65,6 @@ def get_callbacks(args: Namespace, save_path: str) -> List[callbacks]:
             save_on_train_epoch_end=True,
             save_last=True,
         ),
-        # EarlyStopping(
-        #     monitor=args.monitor_stopping,
-        #     mode=args.mode_stopping,
-        #     min_delta=1e-8,
-        #     patience=1000,
-        # ),
     ]
 
 
@@ -62,25 +80,39 @@ def main(args: Namespace, params: dict) -> None:
             "sampling": "random",
             "steps": 70,
             "init_points": 30,
+            # validation uses a fixed set of trajectories, so loss/val is comparable between epochs
+            "online_training": False,
         }
     )
     map_object_val = StandardMap(seed=42, params=val_params)
 
+    cache: Optional[DatasetCache] = None
+    if args.cache_dir is not None:
+        cache = DatasetCache(args.cache_dir, max_size_gb=args.cache_size)
+
     datamodule_train = Data(
         map_object=map_object_train,
         train_size=1.0,
         params=params,
         plot_data=False,
+        cache=cache,
     )
 
+    # NOTE: all validation trajectories go to the validation split, so that loss/val is logged
     datamodule_val = Data(
         map_object=map_object_val,
-        train_size=1.0,
+        train_size=0.0,
         params=val_params,
         plot_data=False,
+        cache=cache,
     )
 
-    tb_logger = TensorBoardLogger(save_dir="", name=args.path, default_hp_metric=False)
+    tb_logger = TensorBoardLogger(
+        save_dir="",
+        name=args.path,
+        version=args.version,
+        default_hp_metric=False,
+    )
 
     save_path: str = os.path.join(tb_logger.name, f"version_{tb_logger.version}")
 
@@ -95,6 +127,8 @@ def main(args: Namespace, params: dict) -> None:
         enable_progress_bar=args.progress_bar,
         devices=args.devices,
         num_nodes=args.num_nodes,
+        # BatchIndexSampler shards batches over processes itself
+        use_distributed_sampler=not params.get("batch_sampler", False),
     )
 
     if trainer.is_global_zero:
@@ -113,6 +147,17 @@ def main(args: Namespace, params: dict) -> None:
         val_dataloaders=datamodule_val.val_dataloader(),
     )
 
+    if trainer.is_global_zero:
+        # NOTE: the last logged best_loss, which update.py also reads from the event files of trials without a
+        # row. It is logged before ModelCheckpoint updates, so it can lag best_model_score by one epoch.
+        best_loss = trainer.callback_metrics.get("best_loss")
+        ResultsStore(args.path).add(
+            version=tb_logger.version,
+            best_loss=float("inf") if best_loss is None else float(best_loss),
+            hparams=dict(model.hparams),
+            pruned=is_pruned(save_path),
+        )
+
 
 def get_model(args: Namespace, params: Dict) -> None:
     if args.checkpoint_path is not None:
@@ -122,14 +167,7 @@ def get_model(args: Namespace, params: Dict) -> None:
         rnn_type = read_yaml(params_path).get("rnn_type")
         params.update({"rnn_type": rnn_type})
 
-    if params.get("rnn_type") == "vanillarnn":
-        from src.VanillaRNN import Vanilla as Model
-    elif params.get("rnn_type") == "mgu":
-        from src.MGU import MGU as Model
-    elif params.get("rnn_type") == "resrnn":
-        from src.ResRNN import ResRNN as Model
-    else:
-        raise ValueError(f"Invalid rnn_type: {params.get('rnn_type')}")
+    Model = get_model_class(params.get("rnn_type"))
 
     Model.compile_model = args.compile
 
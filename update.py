@@ -1,5 +1,8 @@
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import tempfile
 import pandas as pd
 from argparse import Namespace
 import logging
@@ -12,39 +15,88 @@ from src.utils import (
     extract_best_loss_from_event_file,
     Parameter,
 )
+from src.pruning_helper import is_pruned
+from src.results_helper import ResultsStore
 
 
-def get_loss_and_params(dir: str) -> pd.DataFrame:
+def get_loss_and_params(dir: str, workers: int = 16) -> pd.DataFrame:
     logger = logging.getLogger("rnn_autoregressor")
 
-    all_loss_hyperparams = []
+    # NOTE: finished trials are read from the results store, event files are only parsed for legacy runs
+    # (and trials that are still running)
+    store = ResultsStore(dir)
+    stored_results = store.load()
+    stored_versions = store.versions()
+
+    # best_loss per event file, reused while the file is unchanged
+    cache_path = os.path.join(dir, "event_cache.json")
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+
     try:
-        for directory in sorted(os.listdir(dir)):
-            loss_value = None
-            parameter_dict = None
-            if os.path.isdir(os.path.join(dir, directory)):
-                for file in os.listdir(os.path.join(dir, directory)):
-                    if "events" in file.split("."):
-                        file_path = os.path.join(dir, directory, file)
-                        loss_value = extract_best_loss_from_event_file(file_path)
-
-                    elif file == "hparams.yaml":
-                        file_path = os.path.join(dir, directory, file)
-                        parameter_dict = read_yaml(file_path)
-
-                if loss_value and parameter_dict:
-                    all_loss_hyperparams.append(
-                        {
-                            "directory": int(directory.split("_")[-1]),
-                            **loss_value,
-                            **parameter_dict,
-                        }
-                    )
+        directories = [
+            directory
+            for directory in sorted(os.listdir(dir))
+            if os.path.isdir(os.path.join(dir, directory))
+            and not (
+                directory.split("_")[-1].isdigit()
+                and int(directory.split("_")[-1]) in stored_versions
+            )
+        ]
+
+        # directories are read in parallel, results keep their sorted order
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            all_loss_hyperparams = [
+                result
+                for result in executor.map(
+                    lambda directory: _read_version_directory(dir, directory, cache),
+                    directories,
+                )
+                if result is not None
+            ]
     except FileNotFoundError as e:
         logger.error(e)
         raise e
 
-    return pd.DataFrame(all_loss_hyperparams)
+    # written under a unique temporary name first, so that an interrupted or concurrent run never leaves a
+    # broken cache
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        prefix="event_cache_", suffix=".tmp", dir=dir
+    )
+    with os.fdopen(file_descriptor, "w") as file:
+        json.dump(cache, file)
+    os.replace(tmp_path, cache_path)
+
+    return pd.concat(
+        [stored_results, pd.DataFrame(all_loss_hyperparams)], ignore_index=True
+    )
+
+
+def _read_version_directory(dir: str, directory: str, cache: dict) -> Optional[dict]:
+    loss_value = None
+    parameter_dict = None
+    for file in os.listdir(os.path.join(dir, directory)):
+        if "events" in file.split("."):
+            file_path = os.path.join(dir, directory, file)
+            loss_value = extract_best_loss_from_event_file(file_path, cache)
+
+        elif file == "hparams.yaml":
+            file_path = os.path.join(dir, directory, file)
+            parameter_dict = read_yaml(file_path)
+
+    # pruned trials never count as good samples
+    if is_pruned(os.path.join(dir, directory)):
+        loss_value = {"best_loss": float("inf")}
+
+    if loss_value and parameter_dict:
+        return {
+            "directory": int(directory.split("_")[-1]),
+            **loss_value,
+            **parameter_dict,
+        }
+    return None
 
 
 def compute_new_parameter_intervals(